@@ -1,21 +1,22 @@
 from flask import Flask, render_template, request, jsonify, send_file, abort
-import yt_dlp
 import os
 import threading
 import json
+import math
 import http.cookiejar
 import random
-import requests
-import concurrent.futures
-import psutil
 import signal
 import sys
+import time
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
 import tempfile
 import shutil
 import logging
 
+import scheduling
+import urls
+
 # Helper for cookies file cleanup
 import atexit
 _temp_cookies_files = set()
@@ -29,6 +30,13 @@ def _cleanup_temp_cookies():
 
 atexit.register(_cleanup_temp_cookies)
 
+# Heavy modules are imported on first use rather than at import time, so a
+# freshly started process can serve the index page and health checks
+# without loading yt-dlp's extractors first.
+def _yt_dlp():
+    import yt_dlp
+    return yt_dlp
+
 # Initialize Flask app
 app = Flask(__name__)
 
@@ -48,12 +56,20 @@ class ProxyManager:
         self.test_url = 'https://www.google.com/robots.txt'
         self.timeout = 3
         self.max_proxies = 5
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
-            'Accept': 'text/plain',
-            'Connection': 'close'
-        })
+        self._session = None
+
+    @property
+    def session(self):
+        # Created on first use so that importing the app does not pull in requests
+        if self._session is None:
+            import requests
+            self._session = requests.Session()
+            self._session.headers.update({
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36',
+                'Accept': 'text/plain',
+                'Connection': 'close'
+            })
+        return self._session
 
     def is_proxy_working(self, proxy):
         try:
@@ -384,13 +400,107 @@ def save_cookies_to_file(cookies_text):
 
 # Configure output directory
 OUTPUT_DIR = os.path.join(os.path.expanduser("~"), "Downloads")
-if not os.path.exists(OUTPUT_DIR):
-    os.makedirs(OUTPUT_DIR)
+
+def ensure_output_dir():
+    """Create OUTPUT_DIR on first use and return it."""
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+    return OUTPUT_DIR
+
+# Download jobs go through a shared queue (see jobqueue.py) so that any
+# number of web processes and workers, on any number of hosts, can take
+# part. The default SQLite file is shared by all processes on this host.
+JOB_QUEUE_URL = os.environ.get(
+    'JOB_QUEUE_URL',
+    'sqlite:///' + os.path.join(tempfile.gettempdir(), 'youtube_downloader_jobs.db'),
+)
+# Worker threads started inside each web process; set to 0 when jobs are
+# handled by separate `python worker.py` processes instead.
+EMBEDDED_WORKERS = int(os.environ.get('EMBEDDED_WORKERS', 2))
+# A job is failed after its worker dies or hangs this many times
+JOB_MAX_LEASE_LOSSES = int(os.environ.get('JOB_MAX_LEASE_LOSSES', 3))
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+_embedded_workers = []
+
+def get_job_queue():
+    """Return the process-wide job queue, connecting on first use."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                import jobqueue
+                # Cookies stay on the job for as long as a worker may need
+                # them again (lost lease, preemption), then are dropped
+                _job_queue = jobqueue.from_url(JOB_QUEUE_URL, max_lease_losses=JOB_MAX_LEASE_LOSSES,
+                                               transient_fields=('cookies_text',))
+    return _job_queue
+
+def start_embedded_workers():
+    """Start this process's EMBEDDED_WORKERS worker threads, once."""
+    if _embedded_workers or EMBEDDED_WORKERS <= 0:
+        return
+    queue = get_job_queue()
+    with _job_queue_lock:
+        if not _embedded_workers:
+            import worker
+            workers, _ = worker.start_worker_threads(queue, run_download_job, EMBEDDED_WORKERS,
+                                                     on_complete=job_completed)
+            _embedded_workers.extend(workers)
+            print(f"Started {EMBEDDED_WORKERS} embedded download workers")
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+# Liveness and readiness probes (see health.py). HEALTH_PORT serves them
+# outside the request pool; set it to 0 to only serve the routes below.
+HEALTH_PORT = int(os.environ.get('HEALTH_PORT', 8081))
+
+_readiness_check = None
+# Requests this process is handling right now, for the readiness check
+_requests_in_flight = 0
+_requests_in_flight_lock = threading.Lock()
+
+@app.before_request
+def _request_started():
+    global _requests_in_flight
+    with _requests_in_flight_lock:
+        _requests_in_flight += 1
+
+@app.teardown_request
+def _request_finished(exc):
+    global _requests_in_flight
+    with _requests_in_flight_lock:
+        _requests_in_flight -= 1
+
+def requests_in_flight():
+    return _requests_in_flight
+
+def get_readiness_check():
+    global _readiness_check
+    if _readiness_check is None:
+        import health
+        _readiness_check = health.ReadinessCheck(OUTPUT_DIR, requests_in_flight, get_job_queue)
+    return _readiness_check
+
+def start_probe_server():
+    """Serve /healthz and /readyz on HEALTH_PORT from a dedicated thread."""
+    if HEALTH_PORT:
+        import health
+        return health.start_probe_server(HEALTH_PORT, get_readiness_check())
+
+@app.route('/healthz')
+def healthz():
+    import health
+    return jsonify(health.liveness())
+
+@app.route('/readyz')
+def readyz():
+    ready, report = get_readiness_check()()
+    return jsonify(report), 200 if ready else 503
+
 @app.route('/fetch_info', methods=['POST'])
 def fetch_info():
     try:
@@ -405,6 +515,10 @@ def fetch_info():
             
         if not url:
             return jsonify({'error': 'URL is required'}), 400
+        try:
+            url, video_id = urls.canonicalize(url)
+        except urls.InvalidURL as e:
+            return jsonify({'error': str(e)}), 400
 
         # Handle cookies: file upload or textarea
         cookies_path = None
@@ -421,112 +535,104 @@ def fetch_info():
             traceback.print_exc()
             return jsonify({'error': f'Failed to process cookies: {str(e)}'}), 400
 
-        # Always use direct connection, no proxies, pass cookies if present
-        ydl_opts = get_ytdlp_options(None, cookies_path)
+        try:
+            # Always use direct connection, no proxies, pass cookies if present
+            ydl_opts = get_ytdlp_options(None, cookies_path)
         
-        # Add retry logic for failed requests
-        max_retries = 3
-        retry_delay = 2  # seconds
+            # Add retry logic for failed requests
+            max_retries = 3
+            retry_delay = 2  # seconds
+            info = None
+            yt_dlp = _yt_dlp()
         
-        for attempt in range(max_retries):
-            try:
-                # Create a logger for yt-dlp to capture debug output
-                class YTDLLogger:
-                    def debug(self, msg):
-                        if 'HTTP Error' in str(msg) or 'error' in str(msg).lower():
-                            print(f"[yt-dlp DEBUG] {msg}")
-                    def warning(self, msg):
-                        print(f"[yt-dlp WARNING] {msg}")
-                    def error(self, msg):
-                        print(f"[yt-dlp ERROR] {msg}")
-                
-                ydl_opts['logger'] = YTDLLogger()
+            for attempt in range(max_retries):
+                try:
+                    # Create a logger for yt-dlp to capture debug output
+                    class YTDLLogger:
+                        def debug(self, msg):
+                            if 'HTTP Error' in str(msg) or 'error' in str(msg).lower():
+                                print(f"[yt-dlp DEBUG] {msg}")
+                        def warning(self, msg):
+                            print(f"[yt-dlp WARNING] {msg}")
+                        def error(self, msg):
+                            print(f"[yt-dlp ERROR] {msg}")
                 
-                # Clean up the URL to ensure it's in the correct format
-                if 'youtube.com' in url or 'youtu.be' in url:
-                    # Ensure we have a clean URL without extra parameters that might cause issues
-                    from urllib.parse import urlparse, parse_qs, urlunparse
-                    
-                    parsed = urlparse(url)
-                    if 'youtube.com' in parsed.netloc and parsed.path == '/watch':
-                        # Keep only the 'v' parameter for YouTube watch URLs
-                        params = parse_qs(parsed.query)
-                        if 'v' in params:
-                            clean_params = {'v': params['v'][0]}
-                            parsed = parsed._replace(query='&'.join(f"{k}={v[0]}" for k, v in clean_params.items()))
-                            url = urlunparse(parsed)
+                    ydl_opts['logger'] = YTDLLogger()
                 
-                print(f"Attempt {attempt + 1}/{max_retries} - Extracting info for URL: {url}")
-                print(f"Using yt-dlp options: {ydl_opts}")
+                    print(f"Attempt {attempt + 1}/{max_retries} - Extracting info for URL: {url}")
+                    print(f"Using yt-dlp options: {ydl_opts}")
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    try:
-                        info = ydl.extract_info(url, download=False)
-                        print(f"Successfully extracted info. Available keys: {list(info.keys()) if info else 'None'}")
-                        break  # Success, exit retry loop
+                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                        try:
+                            info = ydl.extract_info(url, download=False)
+                            print(f"Successfully extracted info. Available keys: {list(info.keys()) if info else 'None'}")
+                            break  # Success, exit retry loop
                         
-                    except yt_dlp.utils.DownloadError as e:
-                        if 'HTTP Error 403' in str(e) and attempt < max_retries - 1:
-                            print(f"Got 403 error, retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
-                            import time
-                            time.sleep(retry_delay)
-                            continue
-                        raise
+                        except yt_dlp.utils.DownloadError as e:
+                            if 'HTTP Error 403' in str(e) and attempt < max_retries - 1:
+                                print(f"Got 403 error, retrying in {retry_delay} seconds... (Attempt {attempt + 1}/{max_retries})")
+                                import time
+                                time.sleep(retry_delay)
+                                continue
+                            raise
                     
-            except Exception as e:
-                if attempt == max_retries - 1:  # Last attempt
-                    print(f"Final attempt failed with error: {str(e)}")
-                    print(f"Error type: {type(e).__name__}")
-                    import traceback
-                    traceback.print_exc()
-                    raise Exception(f'Failed to extract video info after {max_retries} attempts: {str(e)}')
-                continue
+                except Exception as e:
+                    if attempt == max_retries - 1:  # Last attempt
+                        print(f"Final attempt failed with error: {str(e)}")
+                        print(f"Error type: {type(e).__name__}")
+                        import traceback
+                        traceback.print_exc()
+                        raise Exception(f'Failed to extract video info after {max_retries} attempts: {str(e)}')
+                    continue
         
-        if not info:
-            raise Exception('No video information returned from YouTube')
+            if not info:
+                raise Exception('No video information returned from YouTube')
             
-        # Log some basic info about the video
-        print(f"Video title: {info.get('title', 'N/A')}")
-        print(f"Duration: {info.get('duration', 'N/A')} seconds")
-        print(f"View count: {info.get('view_count', 'N/A')}")
-        print(f"Uploader: {info.get('uploader', 'N/A')}")
-        print(f"Available formats: {len(info.get('formats', []))}")
+            # Log some basic info about the video
+            print(f"Video title: {info.get('title', 'N/A')}")
+            print(f"Duration: {info.get('duration', 'N/A')} seconds")
+            print(f"View count: {info.get('view_count', 'N/A')}")
+            print(f"Uploader: {info.get('uploader', 'N/A')}")
+            print(f"Available formats: {len(info.get('formats', []))}")
                     
-                print(f"Video info: {info.keys()}")  # Debug log
+            print(f"Video info: {info.keys()}")  # Debug log
                 
-                # Extract available formats
-                formats = []
-                if 'formats' not in info or not info['formats']:
-                    raise Exception('No video formats available')
+            # Extract available formats
+            formats = []
+            if 'formats' not in info or not info['formats']:
+                raise Exception('No video formats available')
                     
-                for f in info['formats']:
-                    if not isinstance(f, dict):
-                        print(f"Skipping invalid format: {f}")
-                        continue
+            for f in info['formats']:
+                if not isinstance(f, dict):
+                    print(f"Skipping invalid format: {f}")
+                    continue
                         
-                    format_note = f.get('format_note', f.get('ext', 'unknown'))
-                    ext = f.get('ext', 'unknown')
-                    format_id = f.get('format_id', '0')
+                format_note = f.get('format_note', f.get('ext', 'unknown'))
+                ext = f.get('ext', 'unknown')
+                format_id = f.get('format_id', '0')
                     
-                    if not format_note:
-                        format_note = f"{f.get('height', '?')}p" if f.get('height') else ext
+                if not format_note:
+                    format_note = f"{f.get('height', '?')}p" if f.get('height') else ext
                         
-                    format_str = f"{format_note} - {ext} ({format_id})"
-                    formats.append({
-                        'label': format_str,
-                        'id': format_id
-                    })
+                format_str = f"{format_note} - {ext} ({format_id})"
+                formats.append({
+                    'label': format_str,
+                    'id': format_id,
+                    # Lets /download schedule the job by expected size
+                    'filesize': f.get('filesize') or f.get('filesize_approx'),
+                })
                 
-                if not formats:
-                    raise Exception('No valid formats found')
+            if not formats:
+                raise Exception('No valid formats found')
                 
-                response_data = {
-                    'title': info.get('title', 'Untitled'),
-                    'thumbnail': info.get('thumbnail'),
-                    'formats': formats
-                }
+            response_data = {
+                'title': info.get('title', 'Untitled'),
+                'video_id': video_id,
+                'thumbnail': info.get('thumbnail'),
+                'formats': formats
+            }
                 
-                return jsonify(response_data)
+            return jsonify(response_data)
                 
         except Exception as e:
             print(f"Error in fetch_info: {str(e)}")
@@ -546,6 +652,10 @@ def fetch_info():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 'audio' downloads only an audio-only format and converts it while
+# streaming (see audio.py); 'video' downloads format_id as chosen
+DOWNLOAD_MODES = ('video', 'audio')
+
 @app.route('/download', methods=['POST'])
 def download():
     try:
@@ -555,65 +665,234 @@ def download():
             url = data.get('url')
             format_id = data.get('format_id')
             cookies_text = data.get('cookies_text')
+            priority = data.get('priority')
+            filesize = data.get('filesize')
+            mode = data.get('mode') or 'video'
+            callback_url = data.get('callback_url')
         else:
             url = request.form.get('url')
             format_id = request.form.get('format_id')
             cookies_text = request.form.get('cookies_text')
+            priority = request.form.get('priority')
+            filesize = request.form.get('filesize')
+            mode = request.form.get('mode') or 'video'
+            callback_url = request.form.get('callback_url')
             
-        if not url or not format_id:
+        if mode not in DOWNLOAD_MODES:
+            return jsonify({'error': f"mode must be one of: {', '.join(DOWNLOAD_MODES)}"}), 400
+        # Audio mode picks its own format from the extracted format list
+        if not url or (not format_id and mode != 'audio'):
             return jsonify({'error': 'URL and format_id are required'}), 400
+        if priority and priority not in scheduling.PRIORITIES:
+            return jsonify({'error': f"priority must be one of: {', '.join(scheduling.PRIORITIES)}"}), 400
+        try:
+            url, video_id = urls.canonicalize(url)
+        except urls.InvalidURL as e:
+            return jsonify({'error': str(e)}), 400
+        if callback_url:
+            import webhooks
+            error = webhooks.validate_callback_url(callback_url)
+            if error:
+                return jsonify({'error': error}), 400
             
-        # Handle cookies: file upload or textarea
-        cookies_path = None
+        # Handle cookies: file upload or textarea. The cleaned text travels
+        # with the job, since the worker that runs it may be on another node.
         try:
             if 'cookies_file' in request.files and request.files['cookies_file']:
                 cookies_text = request.files['cookies_file'].read().decode('utf-8')
             
             if cookies_text and cookies_text.strip():
                 print("Processing cookies for download...")
-                cookies_path = save_cookies_to_file(cookies_text)
-                print(f"Using cookies from: {cookies_path}")
+                cookies_text = clean_cookies_text(cookies_text)
+            else:
+                cookies_text = None
         except Exception as e:
             import traceback
             traceback.print_exc()
             return jsonify({'error': f'Failed to process cookies: {str(e)}'}), 400
 
+        # Small and interactive jobs go first; see scheduling.py
+        expected_size = scheduling.expected_size(filesize)
+        priority = scheduling.classify(expected_size, priority)
+        job = get_job_queue().enqueue({
+            'url': url,
+            'video_id': video_id,
+            'format_id': format_id,
+            'mode': mode,
+            'callback_url': callback_url,
+            'cookies_text': cookies_text,
+            'priority': priority,
+            'expected_size': expected_size,
+        }, score=scheduling.job_score(expected_size, priority))
+        start_embedded_workers()
+        # Let a local idle worker pick the job up without waiting for its next poll
+        for embedded_worker in _embedded_workers:
+            embedded_worker.wakeup.set()
+        print(f"Queued download job {job['id']} for {url}")
+
+        return jsonify({'status': 'Download started', 'job_id': job['id'], 'priority': priority})
+
+    except Exception as e:
+        print(f"Error in download: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+# GET /jobs/<id>?wait=N holds the request for up to N seconds (at most
+# LONG_POLL_MAX_WAIT) until the job's status differs from ?status=, or from
+# its status when the request arrived. Each waiter holds a request thread,
+# so only LONG_POLL_MAX_WAITERS per process wait; the rest get a 429 with
+# Retry-After rather than an immediate answer they would re-ask at once.
+LONG_POLL_MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', 30))
+LONG_POLL_MAX_WAITERS = int(os.environ.get('LONG_POLL_MAX_WAITERS', 4))
+LONG_POLL_RETRY_AFTER = int(os.environ.get('LONG_POLL_RETRY_AFTER', 2))
+# How often a waiter re-reads jobs run by other processes
+LONG_POLL_INTERVAL = float(os.environ.get('LONG_POLL_INTERVAL', 0.5))
+
+_long_poll_slots = threading.BoundedSemaphore(LONG_POLL_MAX_WAITERS)
+# Notified when a worker in this process finishes a job
+_job_changed = threading.Condition()
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    queue = get_job_queue()
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = None
+    # min/max let NaN through, which would never time out
+    if wait is None or not math.isfinite(wait):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait = min(max(wait, 0.0), LONG_POLL_MAX_WAIT)
+    status = request.args.get('status') or job['status']
+    import jobqueue
+    if wait and job['status'] == status and status not in jobqueue.TERMINAL_STATUSES:
+        if not _long_poll_slots.acquire(blocking=False):
+            response = jsonify({'error': 'Too many clients waiting on jobs; retry later'})
+            response.headers['Retry-After'] = str(LONG_POLL_RETRY_AFTER)
+            return response, 429
+        try:
+            job = wait_for_status_change(queue, job, status, wait)
+        finally:
+            _long_poll_slots.release()
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+    return jsonify(public_job(job))
+
+def wait_for_status_change(queue, job, status, timeout):
+    """Return the job once its status is not status, or after timeout seconds."""
+    import jobqueue
+    deadline = time.monotonic() + timeout
+    while job is not None and job['status'] == status and status not in jobqueue.TERMINAL_STATUSES:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with _job_changed:
+            _job_changed.wait(min(remaining, LONG_POLL_INTERVAL))
+        job = queue.get(job['id'])
+    return job
+
+_webhook_dispatcher = None
+
+def get_webhook_dispatcher():
+    global _webhook_dispatcher
+    if _webhook_dispatcher is None:
+        with _job_queue_lock:
+            if _webhook_dispatcher is None:
+                import webhooks
+                _webhook_dispatcher = webhooks.WebhookDispatcher()
+                atexit.register(_webhook_dispatcher.close)
+    return _webhook_dispatcher
+
+def job_completed(job):
+    """Worker on_complete hook: wake long-polls and send the job's callback."""
+    with _job_changed:
+        _job_changed.notify_all()
+    if job.get('callback_url'):
+        get_webhook_dispatcher().send(job['callback_url'], f"job.{job['status']}", public_job(job))
+
+def public_job(job):
+    """The parts of a job that are safe to return to clients."""
+    return {k: v for k, v in job.items() if k in PUBLIC_JOB_FIELDS}
+
+PUBLIC_JOB_FIELDS = (
+    'id', 'status', 'url', 'video_id', 'format_id', 'mode', 'priority', 'expected_size', 'preemptions', 'attempts', 'lease_losses', 'created_at', 'started_at',
+    'finished_at', 'updated_at', 'downloaded_bytes', 'total_bytes', 'percent',
+    'filename', 'bytes_transferred', 'error',
+)
+
+def run_download_job(job, context):
+    """Job handler for worker.Worker: download one queued job with yt-dlp."""
+    cookies_path = None
+    cookies_text = job.get('cookies_text')
+    try:
+        if cookies_text:
+            cookies_path = save_cookies_to_file(cookies_text)
+
+        yt_dlp = _yt_dlp()
+        state = {'last_update': 0.0, 'last_preempt_check': time.monotonic(), 'preempted': False}
+
+        def report_progress(downloaded, total, throttle=True):
+            if context.lost.is_set():
+                raise Exception('Lease on job was lost to another worker')
+            now = time.monotonic()
+            if throttle and now - state['last_update'] < 1.0:
+                return
+            state['last_update'] = now
+            context.update(
+                downloaded_bytes=downloaded,
+                total_bytes=total,
+                percent=round(100.0 * downloaded / total, 1) if downloaded and total else None,
+            )
+
+        def job_progress_hook(d):
+            progress_hook(d)
+            if context.lost.is_set():
+                raise Exception('Lease on job was lost to another worker')
+            now = time.monotonic()
+            if (job.get('priority') == scheduling.BULK and d['status'] == 'downloading'
+                    and now - state['last_preempt_check'] >= scheduling.PREEMPT_CHECK_INTERVAL):
+                state['last_preempt_check'] = now
+                queue = get_job_queue()
+                waiting = queue.peek()
+                # Every running bulk job sees the same waiting job; only the
+                # one that reserves it pauses
+                if scheduling.should_preempt(job, waiting) and queue.reserve_preemption(waiting['id'], job['id']):
+                    # yt-dlp keeps the .part file, so the download resumes where it stopped
+                    state['preempted'] = True
+                    raise yt_dlp.utils.DownloadCancelled('Paused for higher priority work')
+            report_progress(d.get('downloaded_bytes'), d.get('total_bytes') or d.get('total_bytes_estimate'),
+                            throttle=d['status'] == 'downloading')
+
         # Always use direct connection with cookies if provided
         ydl_opts = get_ytdlp_options(None, cookies_path)
         ydl_opts.update({
-            'format': format_id,
-            'outtmpl': os.path.join(OUTPUT_DIR, '%(title)s.%(ext)s'),
-            'progress_hooks': [progress_hook],
+            'format': job['format_id'],
+            'outtmpl': os.path.join(ensure_output_dir(), '%(title)s.%(ext)s'),
+            'progress_hooks': [job_progress_hook],
         })
 
-        def download_thread():
-            try:
-                print(f"Starting download with options: {ydl_opts}")
+        print(f"Starting download job {job['id']} with options: {ydl_opts}")
+        try:
+            if job.get('mode') == 'audio':
+                result = download_audio(job, ydl_opts, report_progress)
+            else:
                 with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
-                # If we get here, download was successful
-                print("Download completed successfully")
-            except Exception as e:
-                print(f"Error in download thread: {str(e)}")
-                import traceback
-                traceback.print_exc()
-            finally:
-                # Clean up cookies file if it exists
-                if cookies_path and os.path.exists(cookies_path):
-                    try:
-                        os.remove(cookies_path)
-                        _temp_cookies_files.discard(cookies_path)
-                    except Exception as e:
-                        print(f"Error cleaning up cookies file: {e}")
-
-        # Start download in a separate thread
-        thread = threading.Thread(target=download_thread)
-        thread.daemon = True
-        thread.start()
-
-        return jsonify({'status': 'Download started'})
-
-    except Exception as e:
+                    info = ydl.extract_info(job['url'], download=True)
+                result = {'filename': downloaded_filename(info)}
+        except yt_dlp.utils.DownloadCancelled:
+            if not state['preempted']:
+                raise
+            import worker
+            print(f"Download job {job['id']} paused for higher priority work")
+            raise worker.JobPaused(preemptions=job.get('preemptions', 0) + 1)
+        print(f"Download job {job['id']} completed successfully")
+        return result
+    finally:
         # Clean up cookies file if it exists
         if cookies_path and os.path.exists(cookies_path):
             try:
@@ -621,11 +900,70 @@ def download():
                 _temp_cookies_files.discard(cookies_path)
             except Exception as e:
                 print(f"Error cleaning up cookies file: {e}")
-        
-        print(f"Error in download: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+
+def downloaded_filename(info):
+    """Base name of the file yt-dlp wrote for an extract_info(download=True) result."""
+    downloads = (info or {}).get('requested_downloads') or [{}]
+    filepath = downloads[0].get('filepath')
+    return os.path.basename(filepath) if filepath else None
+
+def download_audio(job, ydl_opts, report_progress):
+    """Download the audio of a job as audio.AUDIO_FORMAT and return the job result.
+
+    Streams the smallest suitable audio-only format through ffmpeg. Videos
+    without one are downloaded by yt-dlp and converted afterwards, reusing
+    the info extracted here rather than extracting it again.
+    """
+    import audio
+    yt_dlp = _yt_dlp()
+    ydl_opts = dict(
+        ydl_opts,
+        format='bestaudio/best',
+        # Only run by the fallback below; streaming converts on the fly
+        postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': audio.AUDIO_FORMAT}],
+        ffmpeg_location=audio.FFMPEG if os.path.sep in audio.FFMPEG else None,
+    )
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(job['url'], download=False)
+        fmt = audio.select_audio_format(info.get('formats') or [], info.get('duration'))
+        if fmt is None:
+            print(f"No streamable audio-only format for job {job['id']}; downloading and converting")
+            # The conversion is another ffmpeg process, so it counts
+            # against the same cap as the streaming pipelines
+            with audio.pipeline_slots:
+                info = ydl.process_ie_result(info, download=True)
+            return {'filename': downloaded_filename(info)}
+
+        output_path = ydl.prepare_filename(dict(info, ext=audio.AUDIO_FORMAT))
+        total = fmt.get('filesize') or fmt.get('filesize_approx')
+        headers = fmt.get('http_headers') or {}
+
+        def open_range(start=None, end=None):
+            request_headers = dict(headers)
+            if start is not None:
+                request_headers['Range'] = f'bytes={start}-{end}'
+            return ydl.urlopen(yt_dlp.networking.Request(fmt['url'], headers=request_headers))
+
+        # Read in the chunks yt-dlp itself would use; googlevideo throttles
+        # un-ranged reads of a whole format
+        chunk_size = audio.chunk_size_for(fmt)
+        source = audio.RangedReader(open_range, chunk_size, total) if chunk_size else open_range()
+        print(f"Streaming audio format {fmt.get('format_id')} for job {job['id']} to {output_path}"
+              + (f" in {chunk_size}-byte ranges" if chunk_size else ''))
+        try:
+            bytes_read = audio.stream_audio(
+                source, output_path, tags=audio.tags_for(info),
+                on_progress=lambda downloaded: report_progress(downloaded, total),
+            )
+        finally:
+            source.close()
+
+    report_progress(bytes_read, bytes_read, throttle=False)
+    return {
+        'filename': os.path.basename(output_path),
+        'format_id': fmt.get('format_id'),
+        'bytes_transferred': bytes_read,
+    }
 
 def progress_hook(d):
     if d['status'] == 'downloading':
@@ -641,4 +979,5 @@ if __name__ == '__main__':
         from gunicorn.app.wsgiapp import WSGIApplication
         WSGIApplication("%s:app" % __name__).run()
     except ImportError:
+        start_probe_server()
         app.run(host='0.0.0.0', port=port, debug=True)
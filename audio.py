@@ -0,0 +1,220 @@
+"""Audio-only downloads.
+
+Instead of downloading a video format (or separate video and audio
+streams merged into mp4) and extracting the audio afterwards, audio mode
+picks the smallest suitable audio-only format from the extracted format
+list and streams it straight through ffmpeg: the response body is piped
+into ffmpeg's stdin, which converts and tags it in one pass and writes to
+the output file through its stdout. Nothing is written and re-read.
+
+Formats that yt-dlp downloads in pieces (downloader_options.http_chunk_size,
+which YouTube sets because googlevideo throttles long un-ranged reads) are
+read the same way, one Range request per chunk, through RangedReader.
+
+Every pipeline runs an ffmpeg process, so at most AUDIO_MAX_CONCURRENCY
+(default: the CPU count) run at the same time; the download-then-convert
+fallback in app.py takes a slot from pipeline_slots as well.
+"""
+import os
+import subprocess
+import threading
+
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+# Output format -> ffmpeg codec and muxer arguments
+AUDIO_FORMATS = {
+    'mp3': ['-c:a', 'libmp3lame', '-q:a', '4', '-f', 'mp3'],
+    'opus': ['-c:a', 'libopus', '-b:a', '96k', '-f', 'opus'],
+}
+AUDIO_FORMAT = os.environ.get('AUDIO_FORMAT', 'mp3')
+# Skip sources below this bitrate (kbps) when better ones exist
+AUDIO_MIN_ABR = float(os.environ.get('AUDIO_MIN_ABR', 64))
+AUDIO_MAX_CONCURRENCY = int(os.environ.get('AUDIO_MAX_CONCURRENCY', 0)) or os.cpu_count() or 1
+
+# Fragmented (DASH/HLS) formats cannot be read as a single response body
+_STREAMABLE_PROTOCOLS = ('http', 'https')
+_CHUNK_SIZE = 64 * 1024
+
+pipeline_slots = threading.BoundedSemaphore(AUDIO_MAX_CONCURRENCY)
+
+
+def _is_audio_only(fmt):
+    return fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')
+
+
+def _estimated_size(fmt, duration):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return size
+    bitrate = fmt.get('abr') or fmt.get('tbr')
+    if bitrate and duration:
+        return bitrate * 1000 / 8 * duration
+    return None
+
+
+def select_audio_format(formats, duration=None, min_abr=AUDIO_MIN_ABR):
+    """Return the smallest audio-only format of at least min_abr kbps.
+
+    Falls back to the highest-bitrate audio-only format when none reaches
+    min_abr. Returns None when there is no streamable audio-only format.
+    """
+    candidates = [
+        f for f in formats
+        if isinstance(f, dict) and f.get('url') and _is_audio_only(f)
+        and f.get('protocol', 'https') in _STREAMABLE_PROTOCOLS
+    ]
+    if not candidates:
+        return None
+
+    suitable = [f for f in candidates if (f.get('abr') or 0) >= min_abr]
+    if not suitable:
+        return max(candidates, key=lambda f: f.get('abr') or 0)
+
+    def size_key(fmt):
+        size = _estimated_size(fmt, duration)
+        # Formats of unknown size go last, lowest bitrate first
+        return (size is None, size or 0, fmt.get('abr') or 0)
+
+    return min(suitable, key=size_key)
+
+
+def chunk_size_for(fmt):
+    """The Range request size yt-dlp would use for fmt, or None."""
+    return (fmt.get('downloader_options') or {}).get('http_chunk_size') or None
+
+
+class RangedReader:
+    """File-like body of a URL fetched in Range requests of chunk_size bytes.
+
+    open_range(start, end) returns a response for bytes start-end
+    (inclusive). A server that ignores Range and answers 200 is read to
+    the end of that one response.
+    """
+
+    def __init__(self, open_range, chunk_size, total=None):
+        self.open_range = open_range
+        self.chunk_size = int(chunk_size)
+        self.total = total
+        self.offset = 0
+        self._response = None
+        self._end = None  # exclusive end of the current range, None if un-ranged
+        self._done = False
+
+    def _open(self):
+        end = self.offset + self.chunk_size
+        if self.total:
+            end = min(end, self.total)
+        response = self.open_range(self.offset, end - 1)
+        if getattr(response, 'status', 206) != 206:
+            if self.offset:
+                response.close()
+                raise Exception(f'Server ignored Range after {self.offset} bytes')
+            end = None
+        else:
+            # Content-Range: bytes 0-1023/4096
+            total = (response.headers.get('Content-Range') or '').rpartition('/')[2]
+            if total.isdigit():
+                self.total = int(total)
+        self._response, self._end = response, end
+
+    def read(self, size=-1):
+        while not self._done:
+            if self._response is None:
+                self._open()
+            data = self._response.read(size)
+            if data:
+                self.offset += len(data)
+                return data
+            self._response.close()
+            self._response = None
+            # A short or un-ranged response ends the body, as does reaching total
+            if self._end is None or self.offset < self._end or (self.total and self.offset >= self.total):
+                self._done = True
+        return b''
+
+    def close(self):
+        self._done = True
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+
+def tags_for(info):
+    """ffmpeg metadata tags for an extracted video."""
+    tags = {
+        'title': info.get('track') or info.get('title'),
+        'artist': info.get('artist') or info.get('uploader'),
+        'album': info.get('album'),
+        'date': (info.get('upload_date') or '')[:4] or None,
+        'comment': info.get('webpage_url'),
+    }
+    return {k: v for k, v in tags.items() if v}
+
+
+def stream_audio(source, output_path, audio_format=AUDIO_FORMAT, tags=None, on_progress=None):
+    """Pipe source through ffmpeg into output_path.
+
+    source is a file-like response body. on_progress(bytes_read) is called
+    after every chunk; it may raise to abort the pipeline. Returns the
+    number of source bytes read.
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f'Unsupported audio format: {audio_format}')
+
+    cmd = [FFMPEG, '-hide_banner', '-nostdin', '-loglevel', 'error', '-i', 'pipe:0',
+           '-vn', '-map_metadata', '-1']
+    for key, value in (tags or {}).items():
+        cmd += ['-metadata', f'{key}={value}']
+    cmd += AUDIO_FORMATS[audio_format] + ['-y', 'pipe:1']
+
+    part_path = output_path + '.part'
+    with pipeline_slots:
+        try:
+            bytes_read = _run_pipeline(cmd, source, part_path, on_progress)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    os.replace(part_path, output_path)
+    return bytes_read
+
+
+def _run_pipeline(cmd, source, part_path, on_progress):
+    bytes_read = 0
+    with open(part_path, 'wb') as output:
+        try:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output, stderr=subprocess.PIPE)
+        except FileNotFoundError:
+            raise Exception(f'ffmpeg not found ({FFMPEG}); it is required for audio downloads')
+
+        # Drain stderr on the side so ffmpeg never blocks on it
+        errors = []
+        stderr_reader = threading.Thread(target=lambda: errors.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+        try:
+            while True:
+                chunk = source.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                bytes_read += len(chunk)
+                process.stdin.write(chunk)
+                if on_progress:
+                    on_progress(bytes_read)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early; its return code says why
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            process.wait()
+            stderr_reader.join()
+
+    if process.returncode != 0:
+        message = b''.join(errors).decode('utf-8', 'replace').strip()
+        raise Exception(f'ffmpeg failed with exit code {process.returncode}: {message}')
+    return bytes_read
@@ -0,0 +1,158 @@
+"""Bytes transferred and end-to-end time of audio-only downloads.
+
+Runs the same videos from benchmarks/media_server.py through three paths
+and reports, per path, the bytes fetched from the media server, the
+completion time (submit to finished job) and the size of the output file:
+
+    video          /download with the hd format, how audio requests were
+                   served before audio mode
+    extract_after  yt-dlp downloads bestaudio to disk, then ffmpeg re-reads
+                   it to convert (FFmpegExtractAudio), run in this process
+    audio          /download with mode=audio: smallest suitable audio-only
+                   format streamed through ffmpeg (see audio.py)
+
+ffmpeg must be on PATH or given with FFMPEG_BINARY. The media server is
+rate limited per connection (--rate-mb) so transfer time counts:
+
+    FFMPEG_BINARY=/usr/bin/ffmpeg python benchmarks/audio_path.py --runs 5
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import requests
+
+from media_server import MB, start_media_server
+from offline import AppUnderTest, ResourceSampler, percentile
+
+PATHS = ('video', 'extract_after', 'audio')
+
+
+class AudioBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.media = start_media_server(rate_limit=int(args.rate_mb * MB))
+        self.app = AppUnderTest(workers=1, threads=4)
+        self.scratch = tempfile.mkdtemp(prefix='audio_bench_')
+        self._counter = 0
+
+    def new_video(self):
+        self._counter += 1
+        return f'{self.args.profile}-audio-{os.getpid()}-{self._counter}'
+
+    def wait_for_job(self, job_id):
+        deadline = time.monotonic() + self.args.timeout
+        while time.monotonic() < deadline:
+            job = requests.get(f'{self.app.base_url}/jobs/{job_id}', timeout=10).json()
+            if job.get('status') in ('finished', 'failed'):
+                return job
+            time.sleep(0.02)
+        raise RuntimeError(f'job {job_id} did not finish within {self.args.timeout}s')
+
+    def run_via_app(self, payload):
+        response = requests.post(f'{self.app.base_url}/download', json=payload, timeout=60)
+        response.raise_for_status()
+        job = self.wait_for_job(response.json()['job_id'])
+        if job['status'] != 'finished':
+            raise RuntimeError(f"{payload}: {job.get('error')}")
+        return os.path.join(self.app.output_dir, job['filename'])
+
+    def run_extract_after(self, url):
+        import yt_dlp
+        opts = {
+            'quiet': True,
+            'noprogress': True,
+            'format': 'bestaudio/best',
+            'outtmpl': os.path.join(self.scratch, '%(title)s.%(ext)s'),
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': '4'}],
+            'ffmpeg_location': os.environ.get('FFMPEG_BINARY') or None,
+        }
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            info = ydl.extract_info(url, download=True)
+        return info['requested_downloads'][0]['filepath']
+
+    def run_once(self, path):
+        video_id = self.new_video()
+        url = f'{self.media.base_url}/watch/{video_id}'
+        served_before = self.media.stats()['bytes_served']
+        start = time.perf_counter()
+        if path == 'video':
+            output = self.run_via_app({'url': url, 'format_id': 'hd'})
+        elif path == 'audio':
+            output = self.run_via_app({'url': url, 'mode': 'audio'})
+        else:
+            output = self.run_extract_after(url)
+        elapsed = (time.perf_counter() - start) * 1000
+        return {
+            'completion_ms': elapsed,
+            'bytes_transferred': self.media.stats()['bytes_served'] - served_before,
+            'output_bytes': os.path.getsize(output),
+        }
+
+    def run_path(self, path):
+        sampler = ResourceSampler(self.app.process.pid)
+        sampler.start()
+        runs = [self.run_once(path) for _ in range(self.args.runs)]
+        usage = sampler.stop()
+        times = [r['completion_ms'] for r in runs]
+        return {
+            'runs': len(runs),
+            'completion_p50_ms': statistics.median(times),
+            'completion_p95_ms': percentile(times, 95),
+            'bytes_transferred': statistics.median(r['bytes_transferred'] for r in runs),
+            'output_bytes': statistics.median(r['output_bytes'] for r in runs),
+            # CPU of the app's processes; extract_after runs in this process instead
+            'app_cpu_seconds': usage['cpu_seconds'],
+        }
+
+    def close(self):
+        self.app.stop()
+        self.media.shutdown()
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        shutil.rmtree(self.app.home, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='downloads per path')
+    parser.add_argument('--profile', default='video', choices=('clip', 'video', 'large'),
+                        help='media_server id prefix, which sets the download sizes')
+    parser.add_argument('--rate-mb', type=float, default=20, help='per-connection bandwidth limit in MB/s')
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    if not shutil.which(os.environ.get('FFMPEG_BINARY', 'ffmpeg')):
+        parser.error('ffmpeg not found; install it or set FFMPEG_BINARY')
+
+    bench = AudioBenchmark(args)
+    results = {}
+    try:
+        bench.app.start()
+        for path in PATHS:
+            results[path] = bench.run_path(path)
+    finally:
+        bench.close()
+
+    print(f"{args.runs} x '{args.profile}' per path at {args.rate_mb:g} MB/s")
+    print(f"{'path':14} {'fetched':>10} {'output':>10} {'p50':>9} {'p95':>9} {'app cpu':>8}")
+    for path, r in results.items():
+        print(f"{path:14} {r['bytes_transferred'] / MB:8.2f}MB {r['output_bytes'] / MB:8.2f}MB "
+              f"{r['completion_p50_ms']:7.0f}ms {r['completion_p95_ms']:7.0f}ms {r['app_cpu_seconds']:7.2f}s")
+    audio, video = results['audio'], results['video']
+    print(f"audio vs video: bytes {audio['bytes_transferred'] / video['bytes_transferred'] - 1:+.0%}, "
+          f"p50 {audio['completion_p50_ms'] / video['completion_p50_ms'] - 1:+.0%}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'paths': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Local stand-in for YouTube used by the offline benchmarks.
+
+Serves canned extractor metadata and synthetic media files so that app.py
+can be exercised end to end without touching the network:
+
+    /watch/<id>          page URL handed to app.py (matched by LocalMediaIE)
+    /api/<id>.json       metadata consumed by LocalMediaIE
+    /media/<id>/<fmt>    synthetic media bytes, with Range support
+    /stats               bytes and requests served so far
+
+Video ids are generated on demand from their prefix, so every request can
+use a fresh id: "clip-*" are short audio clips, "video-*" regular videos
+and "large-*" multi-hundred-MB downloads. Run it standalone with
+
+    python benchmarks/media_server.py --port 8900
+"""
+import argparse
+import json
+import re
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MB = 1024 * 1024
+
+# Size of the largest ("hd") format for each id prefix
+PROFILE_SIZES = {
+    'clip': 2 * MB,
+    'video': 16 * MB,
+    'large': 256 * MB,
+}
+
+# format_id -> (ext, vcodec, acodec, height, abr, share of the hd size)
+FORMATS = [
+    ('audio-low', 'wav', 'none', 'pcm_u8', None, 48, 0.02),
+    ('audio-high', 'wav', 'none', 'pcm_s16le', None, 128, 0.05),
+    ('sd', 'mp4', 'avc1.4d401e', 'mp4a.40.2', 480, None, 0.25),
+    ('hd', 'mp4', 'avc1.640028', 'mp4a.40.2', 1080, None, 1.0),
+]
+
+# Audio formats are real mono WAV files (of noise) so that ffmpeg can
+# decode them: format_id -> (sample rate, bits per sample), matching abr
+WAV_LAYOUTS = {
+    'audio-low': (6000, 8),
+    'audio-high': (8000, 16),
+}
+
+# YouTube's formats carry downloader_options.http_chunk_size (10 MB) and are
+# fetched in Range requests of that size. The audio formats here do the
+# same with a smaller chunk, so that even clips take several requests.
+AUDIO_CHUNK_SIZE = 256 * 1024
+
+_ID_RE = re.compile(r'^(?P<profile>[a-z]+)-[\w-]+$')
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_BLOCK = bytes((i * 2654435761 >> 13) & 0xFF for i in range(64 * 1024))
+
+
+def format_size(video_id, format_id):
+    match = _ID_RE.match(video_id)
+    if not match or match.group('profile') not in PROFILE_SIZES:
+        return None
+    for fmt in FORMATS:
+        if fmt[0] == format_id:
+            return max(int(PROFILE_SIZES[match.group('profile')] * fmt[6]), 1024)
+    return None
+
+
+def wav_header(format_id, size):
+    """RIFF header for a WAV format of size bytes, or b'' for other formats."""
+    if format_id not in WAV_LAYOUTS:
+        return b''
+    rate, bits = WAV_LAYOUTS[format_id]
+    block_align = bits // 8
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', size - 8, b'WAVE',
+        b'fmt ', 16, 1, 1, rate, rate * block_align, block_align, bits,
+        b'data', size - 44,
+    )
+
+
+def video_metadata(base_url, video_id):
+    if format_size(video_id, 'hd') is None:
+        return None
+    formats = []
+    for format_id, ext, vcodec, acodec, height, abr, _ in FORMATS:
+        size = format_size(video_id, format_id)
+        fmt = {
+            'format_id': format_id,
+            'url': f'{base_url}/media/{video_id}/{format_id}',
+            'ext': ext,
+            'vcodec': vcodec,
+            'acodec': acodec,
+            'filesize': size,
+            'format_note': f'{height}p' if height else f'{abr}k audio',
+        }
+        if height:
+            fmt['height'] = height
+        if abr:
+            fmt['abr'] = abr
+        if format_id in WAV_LAYOUTS:
+            fmt['downloader_options'] = {'http_chunk_size': AUDIO_CHUNK_SIZE}
+        formats.append(fmt)
+    return {
+        'id': video_id,
+        'title': video_id,
+        'uploader': 'Local Media',
+        'duration': 60,
+        'thumbnail': f'{base_url}/thumb/{video_id}.jpg',
+        'formats': formats,
+    }
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        self.server.count_request()
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if parts[0] == 'stats':
+            return self._send_json(self.server.stats(), send_body)
+        if parts[0] == 'api' and len(parts) == 2 and parts[1].endswith('.json'):
+            info = video_metadata(self.server.base_url, parts[1][:-len('.json')])
+            if info is None:
+                return self._send_error(404)
+            return self._send_json(info, send_body)
+        if parts[0] == 'watch' and len(parts) == 2:
+            body = f'<html><head><title>{parts[1]}</title></head><body></body></html>'.encode()
+            return self._send_bytes(body, 'text/html', send_body)
+        if parts[0] == 'media' and len(parts) == 3:
+            size = format_size(parts[1], parts[2])
+            if size is None:
+                return self._send_error(404)
+            return self._send_media(size, wav_header(parts[2], size), send_body)
+        return self._send_error(404)
+
+    def _send_error(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _send_bytes(self, body, content_type, send_body):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_json(self, data, send_body):
+        self._send_bytes(json.dumps(data).encode('utf-8'), 'application/json', send_body)
+
+    def _send_media(self, size, header, send_body):
+        start, end = 0, size - 1
+        match = _RANGE_RE.match(self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        offset = start
+        rate = self.server.rate_limit
+        started = time.monotonic()
+        try:
+            while offset <= end:
+                if offset < len(header):
+                    chunk = header[offset:end + 1]
+                else:
+                    block_offset = offset % len(_BLOCK)
+                    chunk = _BLOCK[block_offset:block_offset + end - offset + 1]
+                self.wfile.write(chunk)
+                self.server.count_bytes(len(chunk))
+                offset += len(chunk)
+                if rate:
+                    # Sleep until this connection is back under the rate limit
+                    ahead = (offset - start) / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, rate_limit=0):
+        super().__init__(address, MediaRequestHandler)
+        # Bytes per second per media response; 0 for unlimited
+        self.rate_limit = rate_limit
+        self._lock = threading.Lock()
+        self.bytes_served = 0
+        self.requests_served = 0
+        host, port = self.server_address[:2]
+        self.base_url = f'http://{host}:{port}'
+
+    def count_bytes(self, n):
+        with self._lock:
+            self.bytes_served += n
+
+    def count_request(self):
+        with self._lock:
+            self.requests_served += 1
+
+    def stats(self):
+        with self._lock:
+            return {'bytes_served': self.bytes_served, 'requests_served': self.requests_served}
+
+
+def start_media_server(host='127.0.0.1', port=0, rate_limit=0):
+    """Start a MediaServer on a background thread and return it."""
+    server = MediaServer((host, port), rate_limit)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve synthetic media for the offline benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--rate-mb', type=float, default=0, help='per-connection bandwidth limit in MB/s')
+    args = parser.parse_args()
+
+    server = MediaServer((args.host, args.port), int(args.rate_mb * MB))
+    print(f"Serving synthetic media on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
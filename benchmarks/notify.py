@@ -0,0 +1,191 @@
+"""Status traffic and notification delay: polling vs long-poll vs webhooks.
+
+Submits the same batch of downloads three times against app.py (under
+gunicorn, fed by benchmarks/media_server.py) and learns about completion
+in three ways:
+
+    poll       GET /jobs/<id> every --poll-interval seconds, as our
+               integration scripts do today
+    long_poll  GET /jobs/<id>?wait=30&status=<last seen status>, backing
+               off for Retry-After on a 429 once the app's
+               LONG_POLL_MAX_WAITERS slots are taken
+    webhook    callback_url pointing at a local receiver that checks the
+               signature
+
+For each it reports the status requests sent to the app (and how many of
+them were turned away with a 429) and the delay between a job's
+finished_at and the client finding out. The app runs with its default
+long-poll limits, so with more --jobs than LONG_POLL_MAX_WAITERS some
+long-polls are turned away.
+
+    python benchmarks/notify.py --jobs 8 --poll-interval 1
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from media_server import MB, start_media_server
+from offline import AppUnderTest, percentile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhooks  # noqa: E402
+
+MODES = ('poll', 'long_poll', 'webhook')
+SECRET = 'notify-benchmark-secret'
+TERMINAL = ('finished', 'failed')
+
+
+class WebhookReceiver(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _ReceiverHandler)
+        self.url = f'http://127.0.0.1:{self.server_address[1]}/hook'
+        self.cond = threading.Condition()
+        self.received = {}
+        self.bad_signatures = 0
+
+    def wait_for(self, job_id, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: job_id in self.received, timeout)
+            return self.received.get(job_id)
+
+
+class _ReceiverHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        ok = webhooks.verify(body, self.headers.get('X-Webhook-Timestamp'),
+                             self.headers.get('X-Webhook-Signature'), SECRET)
+        self.send_response(204 if ok else 401)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        with self.server.cond:
+            if not ok:
+                self.server.bad_signatures += 1
+                return
+            job = json.loads(body)['data']
+            self.server.received[job['id']] = (time.time(), job)
+            self.server.cond.notify_all()
+
+
+class NotifyBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.media = start_media_server(rate_limit=int(args.rate_mb * MB))
+        self.receiver = WebhookReceiver()
+        threading.Thread(target=self.receiver.serve_forever, daemon=True).start()
+        os.environ['WEBHOOK_SECRET'] = SECRET
+        # The receiver is on loopback, which callbacks may not reach otherwise
+        os.environ['WEBHOOK_ALLOWED_HOSTS'] = '127.0.0.1'
+        self.app = AppUnderTest(workers=1, threads=args.jobs + 4)
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def submit(self, mode):
+        with self._lock:
+            self._counter += 1
+            video_id = f'{self.args.profile}-notify-{os.getpid()}-{self._counter}'
+        payload = {'url': f'{self.media.base_url}/watch/{video_id}', 'format_id': 'sd'}
+        if mode == 'webhook':
+            payload['callback_url'] = self.receiver.url
+        response = requests.post(f'{self.app.base_url}/download', json=payload, timeout=60)
+        response.raise_for_status()
+        return response.json()['job_id']
+
+    def follow(self, mode, job_id):
+        """Block until the client knows the job is done; returns (requests, throttled, seen_at, job)."""
+        session = requests.Session()
+        url = f'{self.app.base_url}/jobs/{job_id}'
+        deadline = time.monotonic() + self.args.timeout
+        count, throttled, status = 0, 0, None
+        while time.monotonic() < deadline:
+            if mode == 'webhook':
+                received = self.receiver.wait_for(job_id, deadline - time.monotonic())
+                if received:
+                    return 0, 0, received[0], received[1]
+                break
+            params = {'wait': 30, 'status': status} if mode == 'long_poll' and status else None
+            response = session.get(url, params=params, timeout=60)
+            count += 1
+            if response.status_code == 429:
+                throttled += 1
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+                continue
+            response.raise_for_status()
+            job = response.json()
+            status = job['status']
+            if status in TERMINAL:
+                return count, throttled, time.time(), job
+            if mode == 'poll':
+                time.sleep(self.args.poll_interval)
+        raise RuntimeError(f'{mode}: job {job_id} not done within {self.args.timeout}s')
+
+    def run_mode(self, mode):
+        def one():
+            job_id = self.submit(mode)
+            return self.follow(mode, job_id)
+
+        with concurrent.futures.ThreadPoolExecutor(self.args.jobs) as pool:
+            results = list(pool.map(lambda _: one(), range(self.args.jobs)))
+        delays = [(seen - job['finished_at']) * 1000 for _, _, seen, job in results]
+        return {
+            'jobs': len(results),
+            'failed': sum(job['status'] != 'finished' for _, _, _, job in results),
+            'status_requests': sum(count for count, _, _, _ in results),
+            'throttled': sum(throttled for _, throttled, _, _ in results),
+            'notify_delay_p50_ms': statistics.median(delays),
+            'notify_delay_p95_ms': percentile(delays, 95),
+        }
+
+    def close(self):
+        self.app.stop()
+        self.media.shutdown()
+        self.receiver.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=8, help='concurrent downloads per mode')
+    parser.add_argument('--profile', default='video', choices=('clip', 'video', 'large'))
+    parser.add_argument('--rate-mb', type=float, default=2, help='per-connection bandwidth limit in MB/s')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    bench = NotifyBenchmark(args)
+    results = {}
+    try:
+        bench.app.start()
+        for mode in MODES:
+            results[mode] = bench.run_mode(mode)
+        results['webhook']['bad_signatures'] = bench.receiver.bad_signatures
+    finally:
+        bench.close()
+
+    print(f"{args.jobs} '{args.profile}' downloads per mode at {args.rate_mb:g} MB/s")
+    print(f"{'mode':10} {'requests':>9} {'429s':>5} {'delay p50':>10} {'delay p95':>10} {'failed':>7}")
+    for mode, r in results.items():
+        print(f"{mode:10} {r['status_requests']:9} {r['throttled']:5} {r['notify_delay_p50_ms']:8.0f}ms "
+              f"{r['notify_delay_p95_ms']:8.0f}ms {r['failed']:7}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'modes': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
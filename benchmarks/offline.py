@@ -0,0 +1,451 @@
+"""End-to-end benchmark of app.py against the local media server.
+
+Starts benchmarks/media_server.py in-process and app.py under gunicorn with
+the same worker settings as the Dockerfile, with the benchmarks directory
+on PYTHONPATH so yt-dlp loads the LocalMediaIE plugin. Nothing leaves the
+machine. Each scenario reports p50/p95/p99 latency, throughput, and the
+RSS and CPU of the gunicorn process tree. Results are written as JSON so
+two commits can be compared:
+
+    python benchmarks/offline.py --output before.json
+    python benchmarks/offline.py --output after.json --compare before.json
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import psutil
+import requests
+
+from media_server import FORMATS, MB, PROFILE_SIZES, format_size, start_media_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'completion_p50_ms': False,
+    'completion_p95_ms': False,
+    'throughput_rps': True,
+    'throughput_mb_s': True,
+    'rss_peak_mb': False,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * pct / 100
+    lower = int(index)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def latency_summary(latencies, prefix=''):
+    return {
+        f'{prefix}count': len(latencies),
+        f'{prefix}p50_ms': percentile(latencies, 50),
+        f'{prefix}p95_ms': percentile(latencies, 95),
+        f'{prefix}p99_ms': percentile(latencies, 99),
+        f'{prefix}max_ms': max(latencies) if latencies else None,
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class ResourceSampler:
+    """Samples RSS and CPU of a process and all of its children."""
+
+    def __init__(self, pid, interval=0.2):
+        self.root = psutil.Process(pid)
+        self.interval = interval
+        self._stop = threading.Event()
+        self._samples = []
+        self._thread = None
+        self._cpu_start = 0.0
+        self._wall_start = 0.0
+
+    def _processes(self):
+        try:
+            return [self.root] + self.root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _cpu_seconds(self):
+        total = 0.0
+        for proc in self._processes():
+            try:
+                times = proc.cpu_times()
+                total += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _rss(self):
+        total = 0
+        for proc in self._processes():
+            try:
+                total += proc.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._samples.append(self._rss())
+
+    def start(self):
+        self._samples = [self._rss()]
+        self._cpu_start = self._cpu_seconds()
+        self._wall_start = time.perf_counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        wall = time.perf_counter() - self._wall_start
+        cpu = self._cpu_seconds() - self._cpu_start
+        return {
+            'rss_peak_mb': max(self._samples) / MB,
+            'rss_avg_mb': statistics.mean(self._samples) / MB,
+            'cpu_seconds': cpu,
+            'cpu_percent': 100 * cpu / wall if wall else 0.0,
+        }
+
+
+class AppUnderTest:
+    """app.py running under gunicorn against a scratch HOME directory."""
+
+    def __init__(self, workers, threads):
+        self.workers = workers
+        self.threads = threads
+        self.port = free_port()
+        self.health_port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.home = tempfile.mkdtemp(prefix='offline_bench_')
+        self.output_dir = os.path.join(self.home, 'Downloads')
+        self.log_path = os.path.join(self.home, 'app.log')
+        self.process = None
+
+    def start(self, timeout=30):
+        env = dict(os.environ)
+        env['HOME'] = self.home
+        env['HEALTH_PORT'] = str(self.health_port)
+        env['JOB_QUEUE_URL'] = 'sqlite:///' + os.path.join(self.home, 'jobs.db')
+        # The media server is not YouTube; let its URLs through urls.canonicalize
+        env['URL_ALLOWED_HOSTS'] = '127.0.0.1'
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [BENCH_DIR, env.get('PYTHONPATH')]))
+        cmd = [
+            sys.executable, '-m', 'gunicorn',
+            '--bind', f'127.0.0.1:{self.port}',
+            '--workers', str(self.workers),
+            '--threads', str(self.threads),
+            '--timeout', '120',
+            '--worker-class', 'gthread',
+            'app:app',
+        ]
+        self._log = open(self.log_path, 'w', encoding='utf-8')
+        self.process = subprocess.Popen(cmd, cwd=REPO_ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'app exited early, see {self.log_path}')
+            try:
+                if requests.get(self.base_url + '/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f'app did not become ready within {timeout}s, see {self.log_path}')
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self._log.close()
+
+    def downloaded_file(self, video_id, ext):
+        return os.path.join(self.output_dir, f'{video_id}.{ext}')
+
+
+class Harness:
+    def __init__(self, args):
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.media = start_media_server()
+        self.app = AppUnderTest(args.workers, args.threads)
+
+    def new_video(self, profile):
+        with self._lock:
+            self._counter += 1
+            return f'{profile}-{self.run_id}-{self._counter}'
+
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def watch_url(self, video_id):
+        return f'{self.media.base_url}/watch/{video_id}'
+
+    def timed_post(self, path, payload):
+        start = time.perf_counter()
+        response = self.session().post(self.app.base_url + path, json=payload, timeout=300)
+        elapsed = (time.perf_counter() - start) * 1000
+        return response, elapsed
+
+    def fetch_info(self, profile='video', cookies_text=None):
+        payload = {'url': self.watch_url(self.new_video(profile))}
+        if cookies_text:
+            payload['cookies_text'] = cookies_text
+        response, elapsed = self.timed_post('/fetch_info', payload)
+        return response.status_code == 200, elapsed
+
+    def download(self, profile, format_id):
+        """Submit a download and block until the file lands in OUTPUT_DIR."""
+        video_id = self.new_video(profile)
+        start = time.perf_counter()
+        response, elapsed = self.timed_post('/download', {'url': self.watch_url(video_id), 'format_id': format_id})
+        if response.status_code != 200:
+            return False, elapsed, None, 0
+
+        ext = next(fmt[1] for fmt in FORMATS if fmt[0] == format_id)
+        path = self.app.downloaded_file(video_id, ext)
+        size = format_size(video_id, format_id)
+        deadline = time.monotonic() + self.args.download_timeout
+        while time.monotonic() < deadline:
+            if os.path.exists(path) and os.path.getsize(path) >= size:
+                return True, elapsed, (time.perf_counter() - start) * 1000, size
+            time.sleep(0.05)
+        return False, elapsed, None, 0
+
+    def run_scenario(self, name, func):
+        print(f"== {name}")
+        sampler = ResourceSampler(self.app.process.pid)
+        media_before = self.media.stats()['bytes_served']
+        sampler.start()
+        wall_start = time.perf_counter()
+        result = func()
+        wall = time.perf_counter() - wall_start
+        result.update(sampler.stop())
+        result['wall_seconds'] = wall
+        result['media_bytes_served'] = self.media.stats()['bytes_served'] - media_before
+        for key, value in result.items():
+            if isinstance(value, float):
+                print(f"   {key:22s} {value:12.2f}")
+            else:
+                print(f"   {key:22s} {value!s:>12}")
+        return result
+
+    def concurrently(self, calls, concurrency):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(lambda call: call(), calls))
+
+    # Scenarios
+
+    def single_large_download(self):
+        ok, request_ms, completion_ms, size = self.download('large', 'hd')
+        result = latency_summary([request_ms])
+        result.update(latency_summary([completion_ms] if ok else [], prefix='completion_'))
+        result['errors'] = 0 if ok else 1
+        result['bytes'] = size
+        result['throughput_mb_s'] = (size / MB) / (completion_ms / 1000) if ok else 0.0
+        return result
+
+    def fetch_info_burst(self):
+        start = time.perf_counter()
+        results = self.concurrently([self.fetch_info] * self.args.burst_requests, self.args.concurrency)
+        wall = time.perf_counter() - start
+        result = latency_summary([elapsed for ok, elapsed in results if ok])
+        result['errors'] = sum(1 for ok, _ in results if not ok)
+        result['throughput_rps'] = len(results) / wall
+        return result
+
+    def mixed_load(self):
+        rng = random.Random(self.args.seed)
+        calls = []
+        for _ in range(self.args.mixed_requests):
+            roll = rng.random()
+            if roll < 0.6:
+                calls.append(('fetch_info', self.fetch_info))
+            elif roll < 0.8:
+                calls.append(('download', lambda: self.download('clip', 'audio-high')))
+            elif roll < 0.9:
+                calls.append(('download', lambda: self.download('video', 'sd')))
+            else:
+                calls.append(('index', self.index))
+
+        start = time.perf_counter()
+        results = self.concurrently([call for _, call in calls], self.args.concurrency)
+        wall = time.perf_counter() - start
+
+        request_latencies, completions, errors, total_bytes = [], [], 0, 0
+        for (kind, _), outcome in zip(calls, results):
+            if kind == 'download':
+                ok, request_ms, completion_ms, size = outcome
+                if ok:
+                    completions.append(completion_ms)
+                    total_bytes += size
+            else:
+                ok, request_ms = outcome
+            errors += 0 if ok else 1
+            request_latencies.append(request_ms)
+
+        result = latency_summary(request_latencies)
+        result.update(latency_summary(completions, prefix='completion_'))
+        result['errors'] = errors
+        result['throughput_rps'] = len(calls) / wall
+        result['throughput_mb_s'] = (total_bytes / MB) / wall
+        return result
+
+    def cookie_heavy(self):
+        cookies_text = cookie_jar_text(self.args.cookie_count)
+        calls = [lambda: self.fetch_info(cookies_text=cookies_text)] * self.args.cookie_requests
+        start = time.perf_counter()
+        results = self.concurrently(calls, self.args.concurrency)
+        wall = time.perf_counter() - start
+        result = latency_summary([elapsed for ok, elapsed in results if ok])
+        result['errors'] = sum(1 for ok, _ in results if not ok)
+        result['throughput_rps'] = len(results) / wall
+        return result
+
+    def index(self):
+        start = time.perf_counter()
+        response = self.session().get(self.app.base_url + '/', timeout=60)
+        return response.status_code == 200, (time.perf_counter() - start) * 1000
+
+
+def cookie_jar_text(count):
+    lines = ['# Netscape HTTP Cookie File']
+    expires = int(time.time()) + 86400
+    for i in range(count):
+        lines.append(f'.youtube.com\tTRUE\t/\tTRUE\t{expires}\tBENCH_{i}\t{uuid.uuid4().hex}')
+    return '\n'.join(lines) + '\n'
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Return a list of regressions of current against baseline."""
+    regressions = []
+    for name, metrics in current['scenarios'].items():
+        old = baseline.get('scenarios', {}).get(name)
+        if not old:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            new_value, old_value = metrics.get(metric), old.get(metric)
+            if not new_value or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f'{name}.{metric}: {old_value:.2f} -> {new_value:.2f} ({change:+.0%})')
+    return regressions
+
+
+SCENARIOS = ['single_large_download', 'fetch_info_burst', 'mixed_load', 'cookie_heavy']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated subset of: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--compare', metavar='PATH', help='earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='relative change counted as a regression by --compare')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--large-mb', type=int, default=256, help='size of the single large download')
+    parser.add_argument('--burst-requests', type=int, default=50)
+    parser.add_argument('--mixed-requests', type=int, default=60)
+    parser.add_argument('--cookie-requests', type=int, default=20)
+    parser.add_argument('--cookie-count', type=int, default=300, help='cookies per cookie-heavy request')
+    parser.add_argument('--download-timeout', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep', action='store_true', help='keep the scratch directory and app log')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',')]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario: {name}')
+
+    PROFILE_SIZES['large'] = args.large_mb * MB
+    harness = Harness(args)
+    harness.app.start()
+    print(f"app on {harness.app.base_url}, media server on {harness.media.base_url}")
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'keep')},
+        'scenarios': {},
+    }
+    try:
+        for name in scenarios:
+            results['scenarios'][name] = harness.run_scenario(name, getattr(harness, name))
+    finally:
+        harness.app.stop()
+        harness.media.shutdown()
+        if args.keep:
+            print(f"scratch directory kept at {harness.app.home}")
+        else:
+            shutil.rmtree(harness.app.home, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"no regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
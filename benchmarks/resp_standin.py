@@ -0,0 +1,377 @@
+"""In-process stand-in for a Redis server.
+
+Speaks enough of the Redis protocol (RESP) for jobqueue.RedisJobQueue, so
+the Redis backend can be exercised and benchmarked without installing
+Redis. Everything is kept in memory behind a single lock, like Redis'
+single-threaded command loop, and WATCH/MULTI/EXEC transactions run
+their queued commands under that lock in one go. Run standalone with
+
+    python benchmarks/resp_standin.py --port 6390
+"""
+import argparse
+import math
+import socketserver
+import threading
+import time
+
+
+class CommandError(Exception):
+    pass
+
+
+def _parse_score(value):
+    value = value.lower()
+    if value in ('-inf', '+inf', 'inf'):
+        return -math.inf if value == '-inf' else math.inf
+    return float(value)
+
+
+def _parse_bound(value):
+    if value.startswith('('):
+        return _parse_score(value[1:]), True
+    return _parse_score(value), False
+
+
+def _format_score(score):
+    if score == int(score) and abs(score) < 1e17:
+        return str(int(score))
+    return repr(score)
+
+
+class Store:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.strings = {}
+        self.zsets = {}
+        self.expires = {}
+        # Bumped on every write to a key, for WATCH
+        self.versions = {}
+        self._version = 0
+
+    def _touch(self, key):
+        self._version += 1
+        self.versions[key] = self._version
+
+    def _expire(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.time():
+            self.strings.pop(key, None)
+            self.zsets.pop(key, None)
+            del self.expires[key]
+            self._touch(key)
+
+    def _handler(self, args):
+        handler = getattr(self, 'cmd_' + args[0].lower(), None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{args[0]}'")
+        return handler
+
+    def _run(self, args):
+        handler = self._handler(args)
+        for key in args[1:2]:
+            self._expire(key)
+        return handler(*args[1:])
+
+    def execute(self, args):
+        self._handler(args)
+        with self.lock:
+            return self._run(args)
+
+    def watch(self, keys):
+        """Versions of keys, to pass to exec_transaction later."""
+        with self.lock:
+            for key in keys:
+                self._expire(key)
+            return {key: self.versions.get(key) for key in keys}
+
+    def exec_transaction(self, watched, commands):
+        """Run commands atomically; None if a watched key was written since WATCH."""
+        with self.lock:
+            for key in watched:
+                self._expire(key)
+            if any(self.versions.get(key) != version for key, version in watched.items()):
+                return None
+            replies = []
+            for args in commands:
+                try:
+                    replies.append(self._run(args))
+                except CommandError as e:
+                    replies.append(e)
+                except (TypeError, ValueError, IndexError) as e:
+                    replies.append(CommandError(f'ERR {e}'))
+            return replies
+
+    def cmd_ping(self, *args):
+        return args[0] if args else 'PONG'
+
+    def cmd_auth(self, *args):
+        return 'OK'
+
+    def cmd_select(self, db):
+        return 'OK'
+
+    def cmd_flushdb(self):
+        for key in list(self.strings) + list(self.zsets):
+            self._touch(key)
+        self.strings.clear()
+        self.zsets.clear()
+        self.expires.clear()
+        return 'OK'
+
+    cmd_flushall = cmd_flushdb
+
+    def cmd_dbsize(self):
+        return len(self.strings) + len(self.zsets)
+
+    def cmd_get(self, key):
+        return self.strings.get(key)
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        expires_at = None
+        if 'EX' in options:
+            expires_at = time.time() + int(options[options.index('EX') + 1])
+        elif 'PX' in options:
+            expires_at = time.time() + int(options[options.index('PX') + 1]) / 1000
+        if 'NX' in options and key in self.strings:
+            return None
+        if 'XX' in options and key not in self.strings:
+            return None
+        self.strings[key] = value
+        self._touch(key)
+        if expires_at is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = expires_at
+        return 'OK'
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            self._expire(key)
+            if self.strings.pop(key, None) is not None or self.zsets.pop(key, None) is not None:
+                removed += 1
+                self._touch(key)
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_exists(self, *keys):
+        count = 0
+        for key in keys:
+            self._expire(key)
+            count += key in self.strings or key in self.zsets
+        return count
+
+    def cmd_zadd(self, key, *args):
+        flags = set()
+        args = list(args)
+        while args and args[0].upper() in ('NX', 'XX', 'CH', 'GT', 'LT'):
+            flags.add(args.pop(0).upper())
+        if not args or len(args) % 2:
+            raise CommandError('ERR syntax error')
+        zset = self.zsets.setdefault(key, {})
+        added = changed = 0
+        for score, member in zip(args[::2], args[1::2]):
+            score = _parse_score(score)
+            exists = member in zset
+            if ('NX' in flags and exists) or ('XX' in flags and not exists):
+                continue
+            if not exists:
+                added += 1
+            elif zset[member] != score:
+                changed += 1
+            zset[member] = score
+        if not zset:
+            del self.zsets[key]
+        if added or changed:
+            self._touch(key)
+        return added + changed if 'CH' in flags else added
+
+    def _sorted(self, key):
+        return sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def cmd_zpopmin(self, key, count='1'):
+        items = self._sorted(key)[:int(count)]
+        reply = []
+        for member, score in items:
+            del self.zsets[key][member]
+            reply += [member, _format_score(score)]
+        if items:
+            self._touch(key)
+        if key in self.zsets and not self.zsets[key]:
+            del self.zsets[key]
+        return reply
+
+    def cmd_zrem(self, key, *members):
+        zset = self.zsets.get(key, {})
+        removed = sum(1 for member in members if zset.pop(member, None) is not None)
+        if removed:
+            self._touch(key)
+        if key in self.zsets and not zset:
+            del self.zsets[key]
+        return removed
+
+    def cmd_zcard(self, key):
+        return len(self.zsets.get(key, {}))
+
+    def cmd_zscore(self, key, member):
+        score = self.zsets.get(key, {}).get(member)
+        return None if score is None else _format_score(score)
+
+    def cmd_zrange(self, key, start, stop, *options):
+        items = self._sorted(key)
+        start, stop = int(start), int(stop)
+        if stop < 0:
+            stop += len(items)
+        if start < 0:
+            start = max(start + len(items), 0)
+        items = items[start:stop + 1]
+        return self._items_reply(items, options)
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        (low, low_open), (high, high_open) = _parse_bound(low), _parse_bound(high)
+        items = [
+            (member, score) for member, score in self._sorted(key)
+            if (score > low if low_open else score >= low) and (score < high if high_open else score <= high)
+        ]
+        upper = [o.upper() for o in options]
+        if 'LIMIT' in upper:
+            index = upper.index('LIMIT')
+            offset, count = int(options[index + 1]), int(options[index + 2])
+            items = items[offset:] if count < 0 else items[offset:offset + count]
+        return self._items_reply(items, options)
+
+    @staticmethod
+    def _items_reply(items, options):
+        if 'WITHSCORES' in (o.upper() for o in options):
+            reply = []
+            for member, score in items:
+                reply += [member, _format_score(score)]
+            return reply
+        return [member for member, _ in items]
+
+
+def _encode(value):
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, CommandError):
+        return f'-{value}\r\n'.encode()
+    if isinstance(value, bool):
+        return b':%d\r\n' % int(value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_encode(v) for v in value)
+    data = str(value).encode('utf-8')
+    if value in ('OK', 'PONG', 'QUEUED'):
+        return b'+' + data + b'\r\n'
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+class RESPHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Per-connection transaction state: WATCHed key versions and the
+        # commands queued since MULTI
+        self.watched = {}
+        self.queued = None
+
+    def _transaction_command(self, args):
+        """Handle WATCH/MULTI/EXEC/DISCARD/UNWATCH and commands queued by MULTI."""
+        name = args[0].upper()
+        store = self.server.store
+        if name == 'MULTI':
+            if self.queued is not None:
+                raise CommandError('ERR MULTI calls can not be nested')
+            self.queued = []
+            return 'OK'
+        if name in ('EXEC', 'DISCARD'):
+            if self.queued is None:
+                raise CommandError(f'ERR {name} without MULTI')
+            watched, queued = self.watched, self.queued
+            self.watched, self.queued = {}, None
+            return store.exec_transaction(watched, queued) if name == 'EXEC' else 'OK'
+        if name == 'WATCH':
+            if self.queued is not None:
+                raise CommandError('ERR WATCH inside MULTI is not allowed')
+            self.watched.update(store.watch(args[1:]))
+            return 'OK'
+        if name == 'UNWATCH':
+            self.watched = {}
+            return 'OK'
+        # Inside MULTI: check the command exists, run it at EXEC
+        store._handler(args)
+        self.queued.append(args)
+        return 'QUEUED'
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.decode('utf-8').split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2].decode('utf-8'))
+        return args
+
+    def handle(self):
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            if not args:
+                continue
+            try:
+                if self.queued is not None or args[0].upper() in ('WATCH', 'UNWATCH', 'MULTI', 'EXEC', 'DISCARD'):
+                    reply = self._transaction_command(args)
+                else:
+                    reply = self.server.store.execute(args)
+            except CommandError as e:
+                reply = e
+            except (TypeError, ValueError, IndexError) as e:
+                reply = CommandError(f'ERR {e}')
+            try:
+                self.wfile.write(_encode(reply))
+            except ConnectionError:
+                return
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, RESPHandler)
+        self.store = Store()
+        host, port = self.server_address[:2]
+        self.url = f'redis://{host}:{port}/0'
+
+
+def start_resp_server(host='127.0.0.1', port=0):
+    """Start a RESPServer on a background thread and return it."""
+    server = RESPServer((host, port))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve an in-memory Redis stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    args = parser.parse_args()
+
+    server = RESPServer((args.host, args.port))
+    print(f"Redis stand-in listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
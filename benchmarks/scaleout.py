@@ -0,0 +1,204 @@
+"""Throughput of the shared job queue as worker processes are added.
+
+Each worker is a separate process, standing in for a separate node, that
+runs worker.Worker against the queue with a handler that sleeps for
+--job-ms (downloads are I/O bound). The same batch of jobs is drained with
+1, 2, 4, ... workers and the throughput is compared with perfect linear
+scaling. Backends: "sqlite" (a fresh database file) and "redis" (the
+in-process stand-in from resp_standin.py, or --redis-url).
+
+Before timing anything it checks that a worker finishing a job and another
+node reaping the same job's expired lease cannot both win: --race-rounds
+times, a job's lease runs out and finish() races reap() and claim() from
+a second connection. A job that is finished and then claimed again (a second
+download and a second webhook) fails the run.
+
+    python benchmarks/scaleout.py --backend sqlite,redis --workers 1,2,4,8
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import jobqueue  # noqa: E402
+import worker  # noqa: E402
+
+
+def _sleep_handler(job, context):
+    time.sleep(job['sleep_ms'] / 1000)
+    return {'handled_by': context.worker_id}
+
+
+def _worker_process(queue_url, ready, stop, completed):
+    queue = jobqueue.from_url(queue_url)
+    runner = worker.Worker(queue, _sleep_handler, lease_seconds=30, poll_interval=0.01)
+    ready.release()
+    while not stop.is_set():
+        if runner.run_once():
+            with completed.get_lock():
+                completed.value += 1
+        else:
+            time.sleep(runner.poll_interval)
+
+
+def run(queue_url, worker_count, jobs, job_ms):
+    queue = jobqueue.from_url(queue_url)
+    ctx = multiprocessing.get_context('spawn')
+    ready = ctx.Semaphore(0)
+    stop = ctx.Event()
+    completed = ctx.Value('i', 0)
+    processes = [
+        ctx.Process(target=_worker_process, args=(queue_url, ready, stop, completed), daemon=True)
+        for _ in range(worker_count)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        ready.acquire()
+
+    start = time.perf_counter()
+    job_ids = [queue.enqueue({'sleep_ms': job_ms})['id'] for _ in range(jobs)]
+    while completed.value < jobs:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for process in processes:
+        process.join(timeout=10)
+
+    # Any process can read the state of any job
+    handled_by = set()
+    for job_id in job_ids:
+        job = queue.get(job_id)
+        assert job['status'] == jobqueue.FINISHED, job
+        handled_by.add(job['handled_by'])
+    return {
+        'workers': worker_count,
+        'jobs': jobs,
+        'seconds': elapsed,
+        'throughput_jobs_s': jobs / elapsed,
+        'distinct_workers_used': len(handled_by),
+    }
+
+
+def check_reap_vs_finish(queue_url, rounds, lease_seconds=0.02):
+    """Race finish() against reap() and claim(); returns (violations, outcomes)."""
+    owner, reaper = jobqueue.from_url(queue_url), jobqueue.from_url(queue_url)
+    violations, outcomes = [], {'finished': 0, 'reaped': 0}
+    for _ in range(rounds):
+        job = owner.enqueue({'race': True})
+        claimed = owner.claim('owner', lease_seconds)
+        assert claimed and claimed['id'] == job['id'], claimed
+        time.sleep(lease_seconds * 1.5)
+
+        barrier = threading.Barrier(2)
+        result = {}
+
+        # Vary which side gets ahead, so finish() lands at every step of the reap
+        delay = random.uniform(0, 0.003)
+
+        def finish():
+            barrier.wait()
+            time.sleep(delay)
+            result['finished'] = owner.finish(job['id'], 'owner', jobqueue.FINISHED)
+
+        def reap():
+            barrier.wait()
+            reaper.reap()
+            result['reclaimed'] = reaper.claim('reaper', 60)
+
+        threads = [threading.Thread(target=finish), threading.Thread(target=reap)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        reclaimed = result['reclaimed']
+        if reclaimed is not None:
+            assert reclaimed['id'] == job['id'], reclaimed
+            outcomes['reaped'] += 1
+            reaper.finish(job['id'], 'reaper', jobqueue.FINISHED)
+        if result['finished']:
+            outcomes['finished'] += 1
+        if result['finished'] and reclaimed is not None:
+            violations.append(f"job {job['id']} finished by its owner and claimed again "
+                              f"(attempts={reclaimed['attempts']})")
+        elif not result['finished'] and reclaimed is None:
+            violations.append(f"job {job['id']} neither finished nor requeued: {owner.get(job['id'])}")
+    return violations, outcomes
+
+
+def queue_url_for(backend, args):
+    if backend == 'sqlite':
+        return 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='scaleout_'), 'jobs.db')
+    if backend == 'redis':
+        if args.redis_url:
+            jobqueue.from_url(args.redis_url).redis.execute('FLUSHDB')
+            return args.redis_url
+        from resp_standin import start_resp_server
+        return start_resp_server().url
+    raise ValueError(f'unknown backend: {backend}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='sqlite,redis', help='comma-separated: sqlite, redis')
+    parser.add_argument('--workers', default='1,2,4,8', help='comma-separated worker process counts')
+    parser.add_argument('--jobs-per-worker', type=int, default=40)
+    parser.add_argument('--job-ms', type=float, default=50)
+    parser.add_argument('--redis-url', help='use this server instead of the in-process stand-in')
+    parser.add_argument('--race-rounds', type=int, default=200,
+                        help='finish/reap races to check per backend first (0 to skip)')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    counts = [int(n) for n in args.workers.split(',')]
+    backends = args.backend.split(',')
+    for backend in backends:
+        if backend not in ('sqlite', 'redis'):
+            parser.error(f'unknown backend: {backend}')
+
+    results = {'job_ms': args.job_ms, 'races': {}, 'backends': {}}
+    failed = False
+    for backend in backends:
+        if args.race_rounds:
+            violations, outcomes = check_reap_vs_finish(queue_url_for(backend, args), args.race_rounds)
+            print(f"== {backend}: {args.race_rounds} finish/reap races, {outcomes['finished']} finished "
+                  f"by the owner, {outcomes['reaped']} reaped, {len(violations)} violations")
+            for violation in violations[:10]:
+                print(f"   FAIL {violation}")
+            results['races'][backend] = dict(outcomes, violations=len(violations))
+            failed = failed or bool(violations)
+    if failed:
+        return 1
+
+    for backend in backends:
+        rows = []
+        for count in counts:
+            rows.append(run(queue_url_for(backend, args), count, count * args.jobs_per_worker, args.job_ms))
+
+        base = rows[0]['throughput_jobs_s'] / rows[0]['workers']
+        print(f"== {backend}")
+        print(f"   {'workers':>7} {'jobs':>6} {'jobs/s':>9} {'efficiency':>10} {'used':>5}")
+        for row in rows:
+            row['efficiency'] = row['throughput_jobs_s'] / (base * row['workers'])
+            print(f"   {row['workers']:>7} {row['jobs']:>6} {row['throughput_jobs_s']:>9.1f} "
+                  f"{row['efficiency']:>10.0%} {row['distinct_workers_used']:>5}")
+        results['backends'][backend] = rows
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
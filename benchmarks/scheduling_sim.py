@@ -0,0 +1,202 @@
+"""Simulated completion times under FIFO and priority scheduling.
+
+A discrete-event simulation of download workers fed by a Poisson stream of
+jobs shaped like our traffic: mostly small audio clips, some regular
+videos and a few multi-GB 4K downloads. The same job stream is run through
+three policies and the completion time (enqueue to finish) is compared:
+
+    fifo         claim in arrival order, as /download used to
+    sjf          scheduling.job_score: shortest expected job first, with aging
+    sjf+preempt  as sjf, and bulk downloads pause for waiting interactive jobs
+
+The priority policies call the real scheduling.py functions, so changing
+its thresholds changes the simulation too.
+
+    python benchmarks/scheduling_sim.py --workers 2 --utilization 0.8
+"""
+import argparse
+import heapq
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduling  # noqa: E402
+
+MB = scheduling.MB
+
+# (share of jobs, smallest MB, largest MB)
+JOB_MIX = {
+    'audio': (0.70, 3, 15),
+    'video': (0.25, 50, 400),
+    '4k': (0.05, 1500, 6000),
+}
+
+POLICIES = ('fifo', 'sjf', 'sjf+preempt')
+
+
+def generate_jobs(count, workers, bandwidth, utilization, seed):
+    rng = random.Random(seed)
+    kinds = list(JOB_MIX)
+    weights = [JOB_MIX[k][0] for k in kinds]
+    mean_size = sum(share * (low + high) / 2 * MB for share, low, high in JOB_MIX.values())
+    arrival_rate = utilization * workers * bandwidth / mean_size
+
+    jobs, now = [], 0.0
+    for i in range(count):
+        now += rng.expovariate(arrival_rate)
+        kind = rng.choices(kinds, weights)[0]
+        _, low, high = JOB_MIX[kind]
+        size = rng.uniform(low, high) * MB
+        jobs.append({'id': i, 'kind': kind, 'arrival': now, 'size': size})
+    return jobs
+
+
+def simulate(jobs, policy, workers, bandwidth, resume_overhead):
+    """Run the job stream through one policy; returns per-job results."""
+    seq = itertools.count()
+    events = []
+    queue = []
+    running = [None] * workers
+    state = {}
+
+    for job in jobs:
+        priority = scheduling.classify(job['size'])
+        score = job['arrival'] if policy == 'fifo' else scheduling.job_score(job['size'], priority, job['arrival'])
+        state[job['id']] = {
+            'job': job, 'priority': priority, 'score': score, 'created_at': job['arrival'],
+            'remaining': job['size'], 'preemptions': 0, 'token': 0, 'finish': None,
+        }
+        heapq.heappush(events, (job['arrival'], next(seq), 'arrive', job['id']))
+
+    def start(slot, job_state, now):
+        overhead = resume_overhead if job_state['preemptions'] else 0.0
+        job_state['started'] = now + overhead
+        job_state['token'] += 1
+        running[slot] = job_state
+        finish = now + overhead + job_state['remaining'] / bandwidth
+        heapq.heappush(events, (finish, next(seq), 'finish', (slot, job_state['job']['id'], job_state['token'])))
+
+    def dispatch(now):
+        for slot in range(workers):
+            if running[slot] is None and queue:
+                _, _, job_id = heapq.heappop(queue)
+                start(slot, state[job_id], now)
+
+    def maybe_preempt(waiting, now):
+        if running.count(None) or not queue or queue[0][2] != waiting['job']['id']:
+            return
+        candidates = [
+            (s['score'], slot) for slot, s in enumerate(running)
+            if scheduling.should_preempt(s, waiting, now)
+        ]
+        if not candidates:
+            return
+        _, slot = max(candidates)
+        paused = running[slot]
+        progress = max(now - paused['started'], 0.0) * bandwidth
+        paused['remaining'] = max(paused['remaining'] - progress, 0.0)
+        paused['preemptions'] += 1
+        paused['token'] += 1
+        running[slot] = None
+        heapq.heappush(queue, (paused['score'], next(seq), paused['job']['id']))
+        dispatch(now)
+
+    while events:
+        now, _, kind, payload = heapq.heappop(events)
+        if kind == 'arrive':
+            job_state = state[payload]
+            heapq.heappush(queue, (job_state['score'], next(seq), payload))
+            dispatch(now)
+            if policy == 'sjf+preempt' and job_state['priority'] == scheduling.INTERACTIVE:
+                check_at = now + scheduling.PREEMPT_GRACE_SECONDS
+                heapq.heappush(events, (check_at, next(seq), 'check', payload))
+        elif kind == 'check':
+            job_state = state[payload]
+            if job_state['finish'] is None and job_state['token'] == 0:
+                maybe_preempt(job_state, now)
+        elif kind == 'finish':
+            slot, job_id, token = payload
+            job_state = state[job_id]
+            if job_state['token'] != token:
+                continue
+            job_state['finish'] = now
+            running[slot] = None
+            dispatch(now)
+
+    return [
+        {'kind': s['job']['kind'], 'completion': s['finish'] - s['job']['arrival'],
+         'preemptions': s['preemptions']}
+        for s in state.values()
+    ]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def summarize(results):
+    completions = [r['completion'] for r in results]
+    summary = {
+        'median_s': statistics.median(completions),
+        'p95_s': percentile(completions, 95),
+        'preemptions': sum(r['preemptions'] for r in results),
+        'by_kind': {},
+    }
+    for kind in JOB_MIX:
+        values = [r['completion'] for r in results if r['kind'] == kind]
+        if values:
+            summary['by_kind'][kind] = {
+                'median_s': statistics.median(values),
+                'p95_s': percentile(values, 95),
+                'max_s': max(values),
+            }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--bandwidth-mb', type=float, default=25, help='download speed per worker, MB/s')
+    parser.add_argument('--utilization', type=float, default=0.8, help='offered load relative to capacity')
+    parser.add_argument('--resume-overhead', type=float, default=1.0,
+                        help='seconds to re-extract and reconnect when a paused job resumes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    bandwidth = args.bandwidth_mb * MB
+    jobs = generate_jobs(args.jobs, args.workers, bandwidth, args.utilization, args.seed)
+    results = {
+        policy: summarize(simulate(jobs, policy, args.workers, bandwidth, args.resume_overhead))
+        for policy in POLICIES
+    }
+
+    print(f"{args.jobs} jobs, {args.workers} workers at {args.bandwidth_mb:g} MB/s, "
+          f"{args.utilization:.0%} utilization")
+    print(f"{'policy':12} {'median':>9} {'p95':>9} {'audio p50':>10} {'video p50':>10} "
+          f"{'4k p50':>9} {'4k max':>9} {'pauses':>7}")
+    for policy, summary in results.items():
+        kinds = summary['by_kind']
+        print(f"{policy:12} {summary['median_s']:8.1f}s {summary['p95_s']:8.1f}s "
+              f"{kinds['audio']['median_s']:9.1f}s {kinds['video']['median_s']:9.1f}s "
+              f"{kinds['4k']['median_s']:8.1f}s {kinds['4k']['max_s']:8.1f}s {summary['preemptions']:>7}")
+    fifo = results['fifo']
+    for policy in POLICIES[1:]:
+        summary = results[policy]
+        print(f"{policy} vs fifo: median {summary['median_s'] / fifo['median_s'] - 1:+.0%}, "
+              f"p95 {summary['p95_s'] / fifo['p95_s'] - 1:+.0%}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'policies': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
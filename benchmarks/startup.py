@@ -0,0 +1,100 @@
+"""Cold start benchmark for the web app.
+
+Each run starts a fresh interpreter, imports app.py and serves the first
+request to / through Flask's test client, so nothing is cached between
+runs. The median over all runs is compared against the thresholds and the
+script exits non-zero when either one is exceeded.
+
+    python benchmarks/startup.py --runs 7 --max-import-ms 400
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs inside the child interpreter and prints one JSON line
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+response = app.app.test_client().get('/')
+t2 = time.perf_counter()
+heavy = [m for m in ('yt_dlp', 'requests', 'psutil') if m in sys.modules]
+yt_dlp = app._yt_dlp()
+yt_dlp.extractor.gen_extractor_classes()
+t3 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'first_request_ms': (t2 - t1) * 1000,
+    'first_request_status': response.status_code,
+    'yt_dlp_load_ms': (t3 - t2) * 1000,
+    'heavy_modules_at_import': heavy,
+}))
+"""
+
+
+def run_once():
+    # Point HOME at a scratch directory so the run never touches ~/Downloads
+    env = dict(os.environ, HOME=tempfile.mkdtemp(prefix='startup_bench_'))
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=400.0,
+                        help='fail if the median import time exceeds this')
+    parser.add_argument('--max-first-request-ms', type=float, default=200.0,
+                        help='fail if the median first request latency exceeds this')
+    parser.add_argument('--json', metavar='PATH', help='also write the results to PATH')
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {
+        'runs': args.runs,
+        'import_ms': statistics.median(r['import_ms'] for r in runs),
+        'first_request_ms': statistics.median(r['first_request_ms'] for r in runs),
+        'yt_dlp_load_ms': statistics.median(r['yt_dlp_load_ms'] for r in runs),
+        'heavy_modules_at_import': sorted({m for r in runs for m in r['heavy_modules_at_import']}),
+        'thresholds': {
+            'import_ms': args.max_import_ms,
+            'first_request_ms': args.max_first_request_ms,
+        },
+    }
+
+    print(f"import app:          {summary['import_ms']:8.1f} ms (limit {args.max_import_ms:.0f})")
+    print(f"first request to /:  {summary['first_request_ms']:8.1f} ms (limit {args.max_first_request_ms:.0f})")
+    print(f"yt-dlp on first use: {summary['yt_dlp_load_ms']:8.1f} ms")
+    if summary['heavy_modules_at_import']:
+        print(f"heavy modules loaded at import: {', '.join(summary['heavy_modules_at_import'])}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+
+    failures = []
+    if any(r['first_request_status'] != 200 for r in runs):
+        failures.append('first request did not return 200')
+    if summary['import_ms'] > args.max_import_ms:
+        failures.append('import time above threshold')
+    if summary['first_request_ms'] > args.max_first_request_ms:
+        failures.append('first request latency above threshold')
+    if summary['heavy_modules_at_import']:
+        failures.append('heavy modules imported eagerly')
+    for failure in failures:
+        print(f"REGRESSION: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Correctness and speed of urls.canonicalize.
+
+CORPUS lists the URL variants we see from clients together with the
+expected outcome: the video id, ALLOWED for a URL_ALLOWED_HOSTS host that
+passes through, or REJECTED. Every entry is checked first and the script
+exits non-zero on a mismatch. It then times canonicalize over the corpus
+against the cleanup fetch_info used to do inside its retry loop, which
+only handled youtube.com/watch:
+
+    python benchmarks/url_canonicalize.py --iterations 20000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import urls  # noqa: E402
+
+ALLOWED = 'allowed'
+REJECTED = 'rejected'
+ID = 'dQw4w9WgXcQ'
+
+# (url, expected outcome)
+CORPUS = [
+    # watch URLs
+    (f'https://www.youtube.com/watch?v={ID}', ID),
+    (f'http://youtube.com/watch?v={ID}', ID),
+    (f'www.youtube.com/watch?v={ID}', ID),
+    (f'youtube.com/watch?v={ID}', ID),
+    (f'https://www.youtube.com/watch?v={ID}&t=42s', ID),
+    (f'https://www.youtube.com/watch?feature=share&v={ID}', ID),
+    (f'https://www.youtube.com/watch?v={ID}&list=PLx0sYbCqOb8TBPRdmBHs5Iftvv9TPboYG&index=3', ID),
+    (f'https://www.youtube.com/watch?v={ID}#t=1m', ID),
+    (f'https://www.youtube.com/watch/?v={ID}', ID),
+    (f'HTTPS://WWW.YOUTUBE.COM/watch?v={ID}', ID),
+    (f'  https://www.youtube.com/watch?v={ID}\n', ID),
+    # other hosts
+    (f'https://m.youtube.com/watch?v={ID}', ID),
+    (f'https://music.youtube.com/watch?v={ID}&si=abc', ID),
+    (f'https://www.youtube-nocookie.com/embed/{ID}', ID),
+    # short links and path forms
+    (f'https://youtu.be/{ID}', ID),
+    (f'https://youtu.be/{ID}?si=Qz4UkEAwzfQ2J3yh', ID),
+    (f'https://youtu.be/{ID}?t=10', ID),
+    (f'youtu.be/{ID}', ID),
+    (f'https://www.youtube.com/shorts/{ID}', ID),
+    (f'https://youtube.com/shorts/{ID}?feature=share', ID),
+    (f'https://m.youtube.com/shorts/{ID}', ID),
+    (f'https://www.youtube.com/embed/{ID}', ID),
+    (f'https://www.youtube.com/embed/{ID}?autoplay=1', ID),
+    (f'https://www.youtube.com/live/{ID}', ID),
+    (f'https://www.youtube.com/v/{ID}', ID),
+    (f'https://www.youtube.com/e/{ID}', ID),
+    # ids use both cases, digits, - and _
+    ('https://youtu.be/a-B_c1D2e3F', 'a-B_c1D2e3F'),
+    # not a single video
+    ('https://www.youtube.com/', REJECTED),
+    ('https://www.youtube.com/watch', REJECTED),
+    ('https://www.youtube.com/watch?v=', REJECTED),
+    ('https://www.youtube.com/watch?v=short', REJECTED),
+    (f'https://www.youtube.com/watch?v={ID}x', REJECTED),
+    (f'https://www.youtube.com/watch?vv={ID}', REJECTED),
+    ('https://www.youtube.com/playlist?list=PLx0sYbCqOb8TBPRdmBHs5Iftvv9TPboYG', REJECTED),
+    ('https://www.youtube.com/@somechannel', REJECTED),
+    ('https://www.youtube.com/channel/UC38IQsAvIsxxjztdMZQtwHA', REJECTED),
+    ('https://youtu.be/', REJECTED),
+    (f'https://youtu.be/{ID}extra', REJECTED),
+    (f'https://www.youtube.com/shorts/{ID[:10]}', REJECTED),
+    # look-alikes and other sites
+    (f'https://www.youtube.com.evil.example/watch?v={ID}', REJECTED),
+    (f'https://notyoutube.com/watch?v={ID}', REJECTED),
+    (f'https://vimeo.com/{ID}', REJECTED),
+    (f'ftp://www.youtube.com/watch?v={ID}', REJECTED),
+    ('', REJECTED),
+    ('   ', REJECTED),
+    ('not a url', REJECTED),
+    ('https://' + 'a' * 3000, REJECTED),
+    # URL_ALLOWED_HOSTS=127.0.0.1 (the offline benchmarks' media server)
+    ('http://127.0.0.1:8900/watch/clip-1#frag', ALLOWED),
+    ('HTTP://127.0.0.1:8900/watch/video-2', ALLOWED),
+    ('http://127.0.0.2:8900/watch/video-2', REJECTED),
+    ('file:///127.0.0.1/etc/passwd', REJECTED),
+]
+
+ALLOWED_HOSTS = frozenset({'127.0.0.1'})
+
+
+def outcome(url):
+    try:
+        canonical, video_id = urls.canonicalize(url)
+    except urls.InvalidURL:
+        return REJECTED, None
+    if video_id is None:
+        return ALLOWED, canonical
+    return video_id, canonical
+
+
+def check_corpus():
+    failures = []
+    for url, expected in CORPUS:
+        result, canonical = outcome(url)
+        if result != expected:
+            failures.append(f'{url!r}: expected {expected}, got {result}')
+        elif expected not in (ALLOWED, REJECTED) and canonical != urls.CANONICAL_URL.format(expected):
+            failures.append(f'{url!r}: canonical URL {canonical}')
+        elif expected == ALLOWED and '#' in canonical:
+            failures.append(f'{url!r}: fragment kept in {canonical}')
+    return failures
+
+
+def legacy_clean(url):
+    """The cleanup fetch_info ran on every attempt before urls.py."""
+    if 'youtube.com' in url or 'youtu.be' in url:
+        from urllib.parse import urlparse, parse_qs, urlunparse
+
+        parsed = urlparse(url)
+        if 'youtube.com' in parsed.netloc and parsed.path == '/watch':
+            params = parse_qs(parsed.query)
+            if 'v' in params:
+                clean_params = {'v': params['v'][0]}
+                parsed = parsed._replace(query='&'.join(f"{k}={v[0]}" for k, v in clean_params.items()))
+                url = urlunparse(parsed)
+    return url
+
+
+def time_per_call(func, inputs, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for url in inputs:
+            try:
+                func(url)
+            except urls.InvalidURL:
+                pass
+    return (time.perf_counter() - start) / (iterations * len(inputs)) * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000, help='passes over each input set')
+    parser.add_argument('--output', help='write the results as JSON to this path')
+    args = parser.parse_args()
+
+    urls.ALLOWED_HOSTS = ALLOWED_HOSTS
+    failures = check_corpus()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    if failures:
+        return 1
+    print(f"{len(CORPUS)} corpus entries ok")
+
+    valid = [url for url, expected in CORPUS if expected not in (ALLOWED, REJECTED)]
+    rejected = [url for url, expected in CORPUS if expected == REJECTED]
+    watch = [url for url in valid if '/watch' in url]
+    results = {
+        'canonicalize_valid_ns': time_per_call(urls.canonicalize, valid, args.iterations),
+        'canonicalize_rejected_ns': time_per_call(urls.canonicalize, rejected, args.iterations),
+        'canonicalize_watch_ns': time_per_call(urls.canonicalize, watch, args.iterations),
+        'legacy_watch_ns': time_per_call(legacy_clean, watch, args.iterations),
+    }
+    for name, value in results.items():
+        print(f"{name:28} {value:8.0f} ns/call")
+    print(f"watch URLs: {results['legacy_watch_ns'] / results['canonicalize_watch_ns']:.1f}x faster than the old cleanup")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+"""yt-dlp extractor for the benchmark media server (benchmarks/media_server.py).
+
+yt-dlp picks this up as a plugin when the benchmarks directory is on
+PYTHONPATH, which the offline benchmark harness arranges for the app
+process it starts.
+"""
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class LocalMediaIE(InfoExtractor):
+    IE_NAME = 'localmedia'
+    _VALID_URL = r'(?P<base>https?://(?:127\.0\.0\.1|localhost):\d+)/watch/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        base, video_id = self._match_valid_url(url).group('base', 'id')
+        return self._download_json(f'{base}/api/{video_id}.json', video_id)
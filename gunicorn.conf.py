@@ -0,0 +1,29 @@
+"""Gunicorn settings, picked up automatically from the working directory."""
+import os
+import threading
+
+
+def post_fork(server, worker):
+    # Optionally load yt-dlp in the background as soon as a worker is forked,
+    # so the first /fetch_info or /download it serves does not pay for it.
+    if os.environ.get('PREWARM_WORKERS', '').lower() not in ('1', 'true', 'yes'):
+        return
+
+    def prewarm():
+        try:
+            import yt_dlp
+            yt_dlp.extractor.gen_extractor_classes()
+            server.log.info("Worker %s pre-warmed yt-dlp", worker.pid)
+        except Exception as e:
+            server.log.warning("Worker %s pre-warm failed: %s", worker.pid, e)
+
+    threading.Thread(target=prewarm, daemon=True).start()
+
+
+def post_worker_init(worker):
+    import app
+    # Health probes get their own listener so they bypass the request pool
+    app.start_probe_server()
+    # Start the embedded download workers right away, so jobs left in the
+    # shared queue are picked up without waiting for the next /download
+    app.start_embedded_workers()
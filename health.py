@@ -0,0 +1,182 @@
+"""Liveness and readiness probes.
+
+The probes are answered by a small HTTP server on its own thread
+(HEALTH_PORT in app.py), so they keep responding when every thread of the
+gunicorn request pool is busy with slow /fetch_info or /download calls.
+Each web worker starts one; SO_REUSEPORT lets them share the port. The
+same checks are also served as /healthz and /readyz by the app itself.
+
+Readiness fails, and the load balancer stops sending traffic, when every
+request thread of this process is busy, OUTPUT_DIR is running out of space
+or the process is short on memory. Thresholds come from the environment:
+
+    READY_MAX_REQUESTS_IN_FLIGHT  requests this process may be handling
+                                  (default WEB_THREADS; 0 turns it off)
+    READY_MIN_FREE_DISK_MB        free space in OUTPUT_DIR (default 1024)
+    READY_MIN_FREE_MEMORY_MB      memory headroom (default 256)
+
+Only per-process load counts. The job queue is shared by every replica, so
+its depth is the same everywhere: gating on it would take all replicas out
+of rotation at once, although a deep queue just means the workers are
+behind. The depth is still reported, outside the checks.
+"""
+import json
+import os
+import shutil
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MB = 1024 * 1024
+
+# With gunicorn's gthread workers, WEB_THREADS requests fill the process
+MAX_REQUESTS_IN_FLIGHT = int(os.environ.get('READY_MAX_REQUESTS_IN_FLIGHT',
+                                            os.environ.get('WEB_THREADS', 0)))
+MIN_FREE_DISK_MB = int(os.environ.get('READY_MIN_FREE_DISK_MB', 1024))
+MIN_FREE_MEMORY_MB = int(os.environ.get('READY_MIN_FREE_MEMORY_MB', 256))
+# Probes can arrive every few seconds from several sources; reuse results
+CACHE_SECONDS = float(os.environ.get('READY_CACHE_SECONDS', 2))
+
+# (limit, usage) files for cgroup v2 and v1
+_CGROUP_MEMORY_FILES = (
+    ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+    ('/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes'),
+)
+
+
+def liveness():
+    """The process is up and its probe thread is scheduled."""
+    return {'status': 'ok', 'pid': os.getpid()}
+
+
+def memory_headroom():
+    """Bytes of memory still available, honouring a container memory limit.
+
+    psutil reports the host's memory, which inside a container can be far
+    more than the cgroup lets us use.
+    """
+    import psutil
+    available = psutil.virtual_memory().available
+    for limit_path, usage_path in _CGROUP_MEMORY_FILES:
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+            with open(usage_path) as f:
+                usage = int(f.read().strip())
+        except (OSError, ValueError):
+            continue
+        # An unlimited cgroup reports "max" (v2) or a huge number (v1)
+        if limit.isdigit():
+            available = min(available, int(limit) - usage)
+        break
+    return available
+
+
+def free_disk_space(path):
+    """Free bytes on the filesystem holding path, which may not exist yet."""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+class ReadinessCheck:
+    """Callable returning (ready, report), cached for CACHE_SECONDS."""
+
+    def __init__(self, output_dir, requests_in_flight, get_queue=None):
+        self.output_dir = output_dir
+        self.requests_in_flight = requests_in_flight
+        self.get_queue = get_queue
+        self._lock = threading.Lock()
+        self._result = None
+        self._checked_at = 0.0
+
+    def _check(self, name, measure, threshold, ok):
+        try:
+            value = measure()
+        except Exception as e:
+            return name, {'ok': False, 'error': str(e)}
+        return name, {'ok': ok(value, threshold), 'value': value, 'threshold': threshold}
+
+    def _run_checks(self):
+        checks = dict([
+            self._check('requests_in_flight', self.requests_in_flight,
+                        MAX_REQUESTS_IN_FLIGHT, lambda value, limit: not limit or value < limit),
+            self._check('free_disk_mb', lambda: free_disk_space(self.output_dir) // MB,
+                        MIN_FREE_DISK_MB, lambda value, limit: value >= limit),
+            self._check('free_memory_mb', lambda: memory_headroom() // MB,
+                        MIN_FREE_MEMORY_MB, lambda value, limit: value >= limit),
+        ])
+        ready = all(check['ok'] for check in checks.values())
+        report = {'status': 'ready' if ready else 'not ready', 'checks': checks}
+        if self.get_queue is not None:
+            try:
+                report['queue_depth'] = self.get_queue().depth()
+            except Exception as e:
+                report['queue_depth'] = None
+                print(f"Readiness check could not read the queue depth: {e}")
+        return ready, report
+
+    def __call__(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._result is None or now - self._checked_at >= CACHE_SECONDS:
+                self._result = self._run_checks()
+                self._checked_at = now
+            return self._result
+
+
+class _ProbeHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/healthz':
+            self._send(200, liveness())
+        elif path == '/readyz':
+            ready, report = self.server.readiness()
+            self._send(200 if ready else 503, report)
+        else:
+            self._send(404, {'error': 'Not found'})
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _ProbeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, readiness):
+        self.readiness = readiness
+        super().__init__(address, _ProbeHandler)
+
+    def server_bind(self):
+        # Several gunicorn workers listen on the same probe port
+        if hasattr(socket, 'SO_REUSEPORT'):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # Skip HTTPServer.server_bind, which does a reverse DNS lookup
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = self.server_address[:2]
+
+
+def start_probe_server(port, readiness, host='0.0.0.0'):
+    """Serve /healthz and /readyz on a daemon thread. Returns the server, or None."""
+    try:
+        server = _ProbeServer((host, port), readiness)
+    except OSError as e:
+        # Without SO_REUSEPORT only the first worker gets the port
+        print(f"Health probe server not started on port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='health-probes', daemon=True).start()
+    return server
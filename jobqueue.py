@@ -0,0 +1,684 @@
+"""Shared job queue and job state for download workers.
+
+The web tier enqueues jobs and any number of worker processes, on any
+number of nodes, claim them. A claimed job carries a lease that its worker
+renews with heartbeats; when a worker dies the lease runs out and reap()
+puts the job back in the queue for someone else, or fails it once it has
+lost max_lease_losses workers. Every web replica reads job state
+from the same backend, so any of them can report on any job.
+
+The backend is chosen with a URL (JOB_QUEUE_URL in app.py):
+
+    sqlite:///path/to/jobs.db   embedded; shared by processes on one host
+    redis://[:password@]host:6379/0
+                                anything speaking the Redis protocol
+"""
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlparse, unquote
+
+QUEUED = 'queued'
+RUNNING = 'running'
+# Preempted by higher-priority work; waits in the queue like QUEUED
+PAUSED = 'paused'
+FINISHED = 'finished'
+FAILED = 'failed'
+TERMINAL_STATUSES = (FINISHED, FAILED)
+
+# How long finished and failed jobs stay queryable
+DEFAULT_RESULT_TTL = 7 * 24 * 3600
+# A job whose worker vanished this many times is failed instead of requeued,
+# so one that kills its worker cannot take down worker after worker
+DEFAULT_MAX_LEASE_LOSSES = 3
+
+
+class JobQueue:
+    """Interface shared by the queue backends.
+
+    Jobs are plain dicts. Besides the caller's payload every job has an
+    'id', 'status', 'score' (lower runs first), 'worker', 'lease_expires',
+    'attempts', 'created_at' and 'updated_at'.
+
+    Fields named in transient_fields are dropped when a job reaches a
+    terminal status, for payload that only workers need (such as
+    credentials) and that must survive until then for a retry.
+    """
+
+    max_lease_losses = DEFAULT_MAX_LEASE_LOSSES
+    transient_fields = ()
+
+    def enqueue(self, payload, score=None):
+        """Add a job and return it. Jobs with a lower score are claimed first."""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """Return the job with this id, or None."""
+        raise NotImplementedError
+
+    def claim(self, worker_id, lease_seconds):
+        """Lease the next queued job to worker_id and return it, or None."""
+        raise NotImplementedError
+
+    def reap(self, now=None):
+        """Requeue running jobs whose lease has expired.
+
+        Each one counts a lease loss in 'lease_losses'; a job that reaches
+        max_lease_losses is failed instead. Returns the jobs failed.
+        """
+        raise NotImplementedError
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        """Extend the lease. Returns False if worker_id no longer holds the job."""
+        raise NotImplementedError
+
+    def update(self, job_id, worker_id, **fields):
+        """Store progress fields on a running job. Returns False if the lease was lost."""
+        raise NotImplementedError
+
+    def finish(self, job_id, worker_id, status, **fields):
+        """Move a job to a terminal status. Returns False if the lease was lost."""
+        raise NotImplementedError
+
+    def release(self, job_id, worker_id, **fields):
+        """Put a running job back in the queue as PAUSED, keeping its score."""
+        raise NotImplementedError
+
+    def peek(self):
+        """Return the job that would be claimed next, without claiming it."""
+        raise NotImplementedError
+
+    def reserve_preemption(self, waiting_id, job_id):
+        """Record on a waiting job that running job job_id pauses for it.
+
+        Sets 'preempted_job' on the waiting job. Returns False if another
+        job already pauses for it or it is no longer waiting, so that one
+        waiting job pauses at most one running job.
+        """
+        raise NotImplementedError
+
+    def depth(self):
+        """Number of jobs waiting to be claimed."""
+        raise NotImplementedError
+
+    def _drop_transient(self, job):
+        for field in self.transient_fields:
+            job.pop(field, None)
+
+    def _lease_lost(self, job, now):
+        """Move a job out of RUNNING after its lease expired; True if it failed."""
+        losses = job.get('lease_losses', 0) + 1
+        job.update({'lease_losses': losses, 'worker': None, 'lease_expires': None, 'updated_at': now})
+        if losses < self.max_lease_losses:
+            job['status'] = QUEUED
+            return False
+        job.update({
+            'status': FAILED,
+            'error': f'Worker lost the job {losses} times; giving up',
+            'finished_at': now,
+        })
+        self._drop_transient(job)
+        print(f"Job {job['id']} failed after losing its worker {losses} times")
+        return True
+
+    def _new_job(self, payload, score):
+        now = time.time()
+        job = dict(payload)
+        job.update({
+            'id': uuid.uuid4().hex,
+            'status': QUEUED,
+            'score': now if score is None else score,
+            'worker': None,
+            'lease_expires': None,
+            'attempts': 0,
+            'created_at': now,
+            'updated_at': now,
+        })
+        return job
+
+
+class SQLiteJobQueue(JobQueue):
+    """Queue stored in a SQLite database file.
+
+    Claims run inside BEGIN IMMEDIATE transactions, so any number of
+    threads and processes on the same host can share one file.
+    """
+
+    def __init__(self, path, result_ttl=DEFAULT_RESULT_TTL, max_lease_losses=DEFAULT_MAX_LEASE_LOSSES,
+                 transient_fields=()):
+        self.path = path
+        self.result_ttl = result_ttl
+        self.max_lease_losses = max_lease_losses
+        self.transient_fields = tuple(transient_fields)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    worker TEXT,
+                    lease_expires REAL,
+                    updated_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_score ON jobs (status, score)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _row_to_job(row):
+        if row is None:
+            return None
+        job = json.loads(row[6])
+        job.update({
+            'id': row[0],
+            'status': row[1],
+            'score': row[2],
+            'worker': row[3],
+            'lease_expires': row[4],
+            'updated_at': row[5],
+        })
+        return job
+
+    def _write(self, conn, job):
+        conn.execute(
+            "INSERT OR REPLACE INTO jobs (id, status, score, worker, lease_expires, updated_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job['id'], job['status'], job['score'], job['worker'], job['lease_expires'],
+             job['updated_at'], json.dumps(job)),
+        )
+
+    def _select(self, conn, job_id):
+        return self._row_to_job(conn.execute(
+            "SELECT id, status, score, worker, lease_expires, updated_at, data FROM jobs WHERE id = ?",
+            (job_id,)).fetchone())
+
+    def enqueue(self, payload, score=None):
+        job = self._new_job(payload, score)
+        with self._transaction() as conn:
+            self._write(conn, job)
+        return job
+
+    def get(self, job_id):
+        return self._select(self._connection(), job_id)
+
+    def claim(self, worker_id, lease_seconds):
+        now = time.time()
+        # Idle workers poll often; check for work before taking the write lock
+        if self._connection().execute(
+                "SELECT 1 FROM jobs WHERE status IN (?, ?) LIMIT 1", (QUEUED, PAUSED)).fetchone() is None:
+            return None
+        with self._transaction() as conn:
+            if self.result_ttl:
+                conn.execute(
+                    "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                    (FINISHED, FAILED, now - self.result_ttl))
+            job = self._next(conn)
+            if job is None:
+                return None
+            job.update({
+                'status': RUNNING,
+                'worker': worker_id,
+                'lease_expires': now + lease_seconds,
+                'attempts': job.get('attempts', 0) + 1,
+                'started_at': now,
+                'updated_at': now,
+            })
+            self._write(conn, job)
+            return job
+
+    def reap(self, now=None):
+        now = time.time() if now is None else now
+        query = "FROM jobs WHERE status = ? AND lease_expires < ?"
+        if self._connection().execute("SELECT 1 " + query + " LIMIT 1", (RUNNING, now)).fetchone() is None:
+            return []
+        failed = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, status, score, worker, lease_expires, updated_at, data " + query,
+                (RUNNING, now)).fetchall()
+            for row in rows:
+                job = self._row_to_job(row)
+                if self._lease_lost(job, now):
+                    failed.append(job)
+                self._write(conn, job)
+        return failed
+
+    def _next(self, conn):
+        return self._row_to_job(conn.execute(
+            "SELECT id, status, score, worker, lease_expires, updated_at, data FROM jobs "
+            "WHERE status IN (?, ?) ORDER BY score LIMIT 1", (QUEUED, PAUSED)).fetchone())
+
+    def peek(self):
+        return self._next(self._connection())
+
+    def reserve_preemption(self, waiting_id, job_id):
+        with self._transaction() as conn:
+            job = self._select(conn, waiting_id)
+            if job is None or job['status'] not in (QUEUED, PAUSED) or job.get('preempted_job'):
+                return False
+            job['preempted_job'] = job_id
+            self._write(conn, job)
+            return True
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        cursor = self._connection().execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = ?",
+            (time.time() + lease_seconds, job_id, worker_id, RUNNING))
+        return cursor.rowcount == 1
+
+    def _modify(self, job_id, worker_id, fields):
+        with self._transaction() as conn:
+            job = self._select(conn, job_id)
+            if job is None or job['worker'] != worker_id or job['status'] != RUNNING:
+                return False
+            job.update(fields)
+            job['updated_at'] = time.time()
+            if job['status'] != RUNNING:
+                job['worker'] = None
+                job['lease_expires'] = None
+            if job['status'] in TERMINAL_STATUSES:
+                self._drop_transient(job)
+            self._write(conn, job)
+            return True
+
+    def update(self, job_id, worker_id, **fields):
+        return self._modify(job_id, worker_id, fields)
+
+    def finish(self, job_id, worker_id, status, **fields):
+        fields['status'] = status
+        fields['finished_at'] = time.time()
+        return self._modify(job_id, worker_id, fields)
+
+    def release(self, job_id, worker_id, **fields):
+        fields['status'] = PAUSED
+        return self._modify(job_id, worker_id, fields)
+
+    def depth(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, PAUSED)).fetchone()[0]
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class RedisConnection:
+    """Minimal thread-safe client for the Redis serialization protocol (RESP)."""
+
+    def __init__(self, host='localhost', port=6379, db=0, password=None, timeout=10):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rb')
+        if self.password:
+            self._send(('AUTH', self.password))
+        if self.db:
+            self._send(('SELECT', self.db))
+
+    def _close(self):
+        for closable in (self._file, self._sock):
+            if closable is not None:
+                try:
+                    closable.close()
+                except OSError:
+                    pass
+        self._sock = self._file = None
+
+    def _send(self, args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        self._sock.sendall(b''.join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length == -1:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(rest)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f'Unexpected reply: {line!r}')
+
+    def execute(self, *args, retry=True):
+        with self._lock:
+            # Retry once on a dropped connection. Callers pass retry=False
+            # for commands whose reply decides what they do next, since a
+            # resent command that already ran the first time answers
+            # differently.
+            for attempt in range(2 if retry else 1):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._send(args)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt or not retry:
+                        raise
+
+    def transaction(self, keys, prepare):
+        """Run an optimistic WATCH/MULTI/EXEC transaction on keys.
+
+        prepare(read) may read with read(*command) and returns the list of
+        commands to run atomically, or None to write nothing. If anyone
+        writes one of keys between WATCH and EXEC, EXEC does nothing and
+        prepare is called again on fresh data. Returns the EXEC replies, or
+        None if prepare returned None. Nothing is resent on a dropped
+        connection, since EXEC may already have run.
+        """
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self._connect()
+                while True:
+                    self._send(('WATCH',) + tuple(keys))
+                    commands = prepare(lambda *args: self._send(args))
+                    if commands is None:
+                        self._send(('UNWATCH',))
+                        return None
+                    self._send(('MULTI',))
+                    for command in commands:
+                        self._send(command)
+                    replies = self._send(('EXEC',))
+                    if replies is not None:
+                        return replies
+            except BaseException:
+                # Whatever state the transaction was left in, start afresh
+                self._close()
+                raise
+
+
+class RedisJobQueue(JobQueue):
+    """Queue stored on a Redis-protocol server.
+
+    Keys (all under key_prefix):
+        job:<id>   JSON document for the job
+        pending    sorted set of queued and paused job ids, by score
+        leases     sorted set of running job ids, by lease expiry
+
+    Every change to a job document after the claim (heartbeat, update,
+    finish, release, reaping) is a WATCH/MULTI/EXEC transaction that checks
+    the job's status and worker and writes in one step, as SQLiteJobQueue
+    does with BEGIN IMMEDIATE.
+    """
+
+    def __init__(self, connection, key_prefix='ytdl:', result_ttl=DEFAULT_RESULT_TTL,
+                 max_lease_losses=DEFAULT_MAX_LEASE_LOSSES, transient_fields=()):
+        self.redis = connection
+        self.prefix = key_prefix
+        self.result_ttl = result_ttl
+        self.max_lease_losses = max_lease_losses
+        self.transient_fields = tuple(transient_fields)
+        self.pending_key = key_prefix + 'pending'
+        self.leases_key = key_prefix + 'leases'
+
+    def _job_key(self, job_id):
+        return f'{self.prefix}job:{job_id}'
+
+    def _save_command(self, job):
+        args = ('SET', self._job_key(job['id']), json.dumps(job))
+        if job['status'] in TERMINAL_STATUSES and self.result_ttl:
+            args += ('EX', int(self.result_ttl))
+        return args
+
+    def _save(self, job):
+        self.redis.execute(*self._save_command(job))
+
+    def _transition(self, job_id, change, watch=()):
+        """Read a job, then write what change(job, read) returns in one step.
+
+        change gets None for a missing job and returns the commands to run,
+        or None to leave everything alone. The job document (and any extra
+        keys in watch) is WATCHed, so a transition racing another one is
+        retried against the job as the other left it. Returns True if the
+        commands ran.
+        """
+        key = self._job_key(job_id)
+
+        def prepare(read):
+            data = read('GET', key)
+            return change(json.loads(data) if data else None, read)
+
+        return self.redis.transaction((key,) + tuple(watch), prepare) is not None
+
+    def enqueue(self, payload, score=None):
+        job = self._new_job(payload, score)
+        self._save(job)
+        self.redis.execute('ZADD', self.pending_key, repr(job['score']), job['id'])
+        return job
+
+    def get(self, job_id):
+        data = self.redis.execute('GET', self._job_key(job_id))
+        return json.loads(data) if data else None
+
+    def reap(self, now=None):
+        now = time.time() if now is None else now
+        failed = []
+        expired = self.redis.execute('ZRANGEBYSCORE', self.leases_key, '-inf', repr(now))
+        for job_id in expired or []:
+            outcome = []
+
+            def requeue(job, read, job_id=job_id):
+                # Check again under WATCH: since ZRANGEBYSCORE the lease may
+                # have been renewed, or the job finished or reaped elsewhere
+                lease = read('ZSCORE', self.leases_key, job_id)
+                if lease is None or float(lease) > now:
+                    return None
+                drop_lease = ('ZREM', self.leases_key, job_id)
+                if job is None or job['status'] in TERMINAL_STATUSES:
+                    return [drop_lease]
+                if job['status'] in (QUEUED, PAUSED):
+                    # A claim that stopped between its two steps; the job may
+                    # already have left pending, so make sure it is queued
+                    return [('ZADD', self.pending_key, 'NX', repr(job['score']), job_id), drop_lease]
+                outcome[:] = [job]
+                if self._lease_lost(job, now):
+                    return [self._save_command(job), drop_lease]
+                return [self._save_command(job), ('ZADD', self.pending_key, repr(job['score']), job_id),
+                        drop_lease]
+
+            # Watching leases as well lets a heartbeat that lands in between win
+            if self._transition(job_id, requeue, watch=(self.leases_key,)) and outcome:
+                if outcome[0]['status'] == FAILED:
+                    failed.append(outcome[0])
+        return failed
+
+    # Head of pending tried per round when other workers are claiming too
+    CLAIM_CANDIDATES = 10
+
+    def claim(self, worker_id, lease_seconds):
+        now = time.time()
+        lease_expires = now + lease_seconds
+        while True:
+            candidates = self.redis.execute('ZRANGE', self.pending_key, 0, self.CLAIM_CANDIDATES - 1)
+            if not candidates:
+                return None
+            job_id, contended = None, 0
+            for candidate in candidates:
+                # Take a lease before leaving pending, so the job is always in
+                # one of the two sets and an interrupted claim is reaped like
+                # a dead worker. Neither step is resent: a repeat would report
+                # a step that succeeded as lost.
+                if self.redis.execute('ZADD', self.leases_key, 'NX', repr(lease_expires), candidate,
+                                      retry=False) != 1:
+                    contended += 1  # Someone else is claiming it
+                    continue
+                if self.redis.execute('ZREM', self.pending_key, candidate, retry=False) == 1:
+                    job_id = candidate
+                    break
+                # Claimed and finished by someone else since ZRANGE; drop our lease
+                self.redis.execute('ZREM', self.leases_key, candidate)
+            if job_id is None:
+                if contended == len(candidates):
+                    return None
+                continue
+
+            claimed = []
+
+            def start(job, read):
+                if job is None:
+                    # Expired or deleted while queued
+                    return [('ZREM', self.leases_key, job_id)]
+                job.update({
+                    'status': RUNNING,
+                    'worker': worker_id,
+                    'lease_expires': lease_expires,
+                    'attempts': job.get('attempts', 0) + 1,
+                    'started_at': now,
+                    'updated_at': now,
+                })
+                claimed[:] = [job]
+                return [self._save_command(job)]
+
+            self._transition(job_id, start)
+            if claimed:
+                return claimed[0]
+
+    def _change_owned(self, job_id, worker_id, change):
+        """_transition for a job that worker_id holds; False if it does not."""
+        def checked(job, read):
+            if job is None or job['worker'] != worker_id or job['status'] != RUNNING:
+                return None
+            return change(job)
+
+        return self._transition(job_id, checked)
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        lease_expires = time.time() + lease_seconds
+        return self._change_owned(job_id, worker_id, lambda job: [
+            ('ZADD', self.leases_key, 'XX', repr(lease_expires), job_id)])
+
+    def update(self, job_id, worker_id, **fields):
+        def change(job):
+            job.update(fields)
+            job['updated_at'] = time.time()
+            return [self._save_command(job)]
+
+        return self._change_owned(job_id, worker_id, change)
+
+    def finish(self, job_id, worker_id, status, **fields):
+        def change(job):
+            now = time.time()
+            job.update(fields)
+            job.update({
+                'status': status,
+                'worker': None,
+                'lease_expires': None,
+                'finished_at': now,
+                'updated_at': now,
+            })
+            self._drop_transient(job)
+            return [self._save_command(job), ('ZREM', self.leases_key, job_id)]
+
+        return self._change_owned(job_id, worker_id, change)
+
+    def release(self, job_id, worker_id, **fields):
+        def change(job):
+            job.update(fields)
+            job.update({'status': PAUSED, 'worker': None, 'lease_expires': None, 'updated_at': time.time()})
+            return [self._save_command(job), ('ZADD', self.pending_key, repr(job['score']), job_id),
+                    ('ZREM', self.leases_key, job_id)]
+
+        return self._change_owned(job_id, worker_id, change)
+
+    def reserve_preemption(self, waiting_id, job_id):
+        def reserve(job, read):
+            if job is None or job['status'] not in (QUEUED, PAUSED) or job.get('preempted_job'):
+                return None
+            job['preempted_job'] = job_id
+            return [self._save_command(job)]
+
+        return self._transition(waiting_id, reserve)
+
+    def peek(self):
+        while True:
+            head = self.redis.execute('ZRANGE', self.pending_key, 0, 0)
+            if not head:
+                return None
+            job = self.get(head[0])
+            if job is not None:
+                return job
+            # Expired or deleted while queued
+            self.redis.execute('ZREM', self.pending_key, head[0])
+
+    def depth(self):
+        return self.redis.execute('ZCARD', self.pending_key)
+
+
+def from_url(url, **options):
+    """Create a queue backend from a sqlite:// or redis:// URL.
+
+    options (result_ttl, max_lease_losses, transient_fields) are passed to
+    the backend.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme == 'sqlite':
+        # sqlite:///relative.db and sqlite:////absolute/path.db, as in SQLAlchemy
+        path = parsed.path[1:] if parsed.path.startswith('/') else parsed.path
+        if not path:
+            raise ValueError(f'No database path in job queue URL: {url}')
+        return SQLiteJobQueue(unquote(path), **options)
+    if parsed.scheme == 'redis':
+        db = parsed.path.strip('/')
+        connection = RedisConnection(
+            host=parsed.hostname or 'localhost',
+            port=parsed.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parsed.password) if parsed.password else None,
+        )
+        return RedisJobQueue(connection, **options)
+    raise ValueError(f'Unsupported job queue URL: {url}')
@@ -0,0 +1,91 @@
+"""Priorities for download jobs.
+
+The queue claims jobs in order of a single score, lowest first. The score
+is the job's enqueue time pushed back by a delay that grows with the
+expected download size and is larger for bulk jobs:
+
+    score = enqueued_at + CLASS_DELAY[priority] + min(size / AGING_BYTES_PER_SECOND, MAX_SIZE_DELAY)
+
+Small jobs therefore run before large ones (shortest expected job first),
+while the delay is capped: a job only waits behind work that arrived
+less than CLASS_DELAY + MAX_SIZE_DELAY seconds after it, so large
+downloads age into the front of the queue instead of starving.
+
+A running bulk job is paused (see should_preempt) when an interactive job
+with a lower score has been waiting for PREEMPT_GRACE_SECONDS; it keeps
+its score and resumes from its partial file once it is claimed again.
+"""
+import os
+import time
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = (INTERACTIVE, BULK)
+
+MB = 1024 * 1024
+
+# Jobs expected to be larger than this are bulk unless the client says otherwise
+BULK_THRESHOLD_BYTES = int(os.environ.get('SCHED_BULK_THRESHOLD_MB', 200)) * MB
+# Assumed size when extraction did not report one
+DEFAULT_EXPECTED_BYTES = int(os.environ.get('SCHED_DEFAULT_EXPECTED_MB', 50)) * MB
+# Every AGING_BYTES_PER_SECOND of expected size delays a job by one second...
+AGING_BYTES_PER_SECOND = int(os.environ.get('SCHED_AGING_MB_PER_SECOND', 10)) * MB
+# ...up to this many seconds
+MAX_SIZE_DELAY = float(os.environ.get('SCHED_MAX_SIZE_DELAY', 600))
+CLASS_DELAY = {
+    INTERACTIVE: 0.0,
+    BULK: float(os.environ.get('SCHED_BULK_DELAY', 60)),
+}
+
+# How long an interactive job must wait before it pauses a bulk job
+PREEMPT_GRACE_SECONDS = float(os.environ.get('SCHED_PREEMPT_GRACE', 2))
+# How often a running bulk job checks whether it should pause
+PREEMPT_CHECK_INTERVAL = float(os.environ.get('SCHED_PREEMPT_CHECK_INTERVAL', 2))
+# A job is not paused again after this many pauses
+MAX_PREEMPTIONS = int(os.environ.get('SCHED_MAX_PREEMPTIONS', 5))
+
+
+def expected_size(value):
+    """Parse a client-supplied size in bytes; None if missing or invalid."""
+    try:
+        size = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return size if size > 0 else None
+
+
+def classify(size, priority=None):
+    """Return the priority class for a job of the given expected size."""
+    if priority in PRIORITIES:
+        return priority
+    if size is not None and size > BULK_THRESHOLD_BYTES:
+        return BULK
+    return INTERACTIVE
+
+
+def job_score(size, priority, enqueued_at=None):
+    """Queue score for a new job; lower scores are claimed first."""
+    if enqueued_at is None:
+        enqueued_at = time.time()
+    if size is None:
+        size = DEFAULT_EXPECTED_BYTES
+    size_delay = min(size / AGING_BYTES_PER_SECOND, MAX_SIZE_DELAY)
+    return enqueued_at + CLASS_DELAY.get(priority, 0.0) + size_delay
+
+
+def should_preempt(job, waiting, now=None):
+    """Whether the running job should pause so the waiting job can run.
+
+    waiting is the queue's next job (JobQueue.peek()), or None. A waiting
+    job that another job already pauses for (see
+    JobQueue.reserve_preemption) pauses nothing else.
+    """
+    if waiting is None or job.get('priority') != BULK or waiting.get('preempted_job'):
+        return False
+    if waiting.get('priority') != INTERACTIVE or waiting['score'] >= job['score']:
+        return False
+    if job.get('preemptions', 0) >= MAX_PREEMPTIONS:
+        return False
+    if now is None:
+        now = time.time()
+    return now - waiting['created_at'] >= PREEMPT_GRACE_SECONDS
@@ -0,0 +1,88 @@
+"""Canonical video URLs.
+
+Every way of linking to a YouTube video (youtu.be/ID, /shorts/ID,
+/embed/ID, /live/ID, m.youtube.com, music.youtube.com, youtube-nocookie,
+watch URLs with extra parameters) is mapped to its 11-character video id
+and to https://www.youtube.com/watch?v=ID. Jobs and any cache can then key
+on the id, and yt-dlp always sees the same URL.
+
+Anything else is rejected before yt-dlp is touched, unless its host is
+listed in URL_ALLOWED_HOSTS (comma-separated host or host:port), which
+lets other sites through unchanged apart from dropping the fragment.
+
+The patterns are compiled once at import; canonicalize() does no URL
+parsing for YouTube links.
+"""
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+MAX_URL_LENGTH = 2048
+
+ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.environ.get('URL_ALLOWED_HOSTS', '').split(',') if host.strip()
+)
+
+_VIDEO_ID = r'[0-9A-Za-z_-]{11}'
+_YOUTUBE_HOST = r'(?i:(?:https?://)?(?:(?:www|m|music)\.)?(?:youtube\.com|youtube-nocookie\.com))'
+
+# /watch?...v=ID... with the query captured for _WATCH_ID_RE
+_WATCH_RE = re.compile(_YOUTUBE_HOST + r'/watch/?\?(?P<query>[^#]*)(?:#.*)?$')
+# /shorts/ID, /embed/ID, /live/ID, /v/ID, /e/ID
+_PATH_RE = re.compile(_YOUTUBE_HOST + r'/(?:shorts|embed|live|v|e)/(?P<id>' + _VIDEO_ID + r')(?:[/?#&].*)?$')
+_SHORT_RE = re.compile(r'(?i:(?:https?://)?(?:www\.)?youtu\.be)/(?P<id>' + _VIDEO_ID + r')(?:[/?#&].*)?$')
+_WATCH_ID_RE = re.compile(r'(?:^|&)v=(?P<id>' + _VIDEO_ID + r')(?:&|$)')
+# Cheap pre-check: does the URL claim to be YouTube at all?
+_YOUTUBE_HINT_RE = re.compile(r'(?i)^(?:https?://)?(?:[\w-]+\.)?(?:youtube\.com|youtube-nocookie\.com|youtu\.be)(?:[/:?#]|$)')
+
+CANONICAL_URL = 'https://www.youtube.com/watch?v={}'
+
+
+class InvalidURL(ValueError):
+    """The URL is malformed or not a supported video link."""
+
+
+def youtube_video_id(url):
+    """Return the video id of a YouTube link, or None."""
+    match = _SHORT_RE.match(url) or _PATH_RE.match(url)
+    if match:
+        return match.group('id')
+    match = _WATCH_RE.match(url)
+    if match:
+        match = _WATCH_ID_RE.search(match.group('query'))
+        if match:
+            return match.group('id')
+    return None
+
+
+def canonicalize(url):
+    """Return (canonical_url, video_id) for a URL submitted by a client.
+
+    video_id is None for URLs on URL_ALLOWED_HOSTS. Raises InvalidURL for
+    anything else that is not a link to a single YouTube video.
+    """
+    if not isinstance(url, str):
+        raise InvalidURL('URL must be a string')
+    url = url.strip()
+    if not url:
+        raise InvalidURL('URL is required')
+    if len(url) > MAX_URL_LENGTH:
+        raise InvalidURL(f'URL is longer than {MAX_URL_LENGTH} characters')
+
+    video_id = youtube_video_id(url)
+    if video_id:
+        return CANONICAL_URL.format(video_id), video_id
+    if _YOUTUBE_HINT_RE.match(url):
+        raise InvalidURL('Not a link to a single YouTube video')
+
+    if ALLOWED_HOSTS:
+        try:
+            parts = urlsplit(url)
+            host = (parts.hostname or '').lower()
+            port = parts.port
+        except ValueError:
+            raise InvalidURL('Malformed URL')
+        if parts.scheme.lower() in ('http', 'https') and (
+                host in ALLOWED_HOSTS or f'{host}:{port}' in ALLOWED_HOSTS):
+            return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.query, '')), None
+    raise InvalidURL('Unsupported URL; only YouTube video links are accepted')
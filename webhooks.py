@@ -0,0 +1,297 @@
+"""Signed job completion callbacks.
+
+A job submitted with a callback_url gets one POST when it finishes or
+fails. The JSON body is signed with HMAC-SHA256 using WEBHOOK_SECRET:
+
+    X-Webhook-Id         stable for all attempts of one notification
+    X-Webhook-Timestamp  unix time of this attempt
+    X-Webhook-Signature  sha256=<hex HMAC of "<timestamp>.<body>">
+
+Receivers should recompute the signature and reject stale timestamps.
+
+Deliveries are handed to a WebhookDispatcher owned by the process whose
+worker finished the job. A fixed set of sender threads shares one pooled
+requests session, so at most WEBHOOK_CONCURRENCY deliveries are in flight.
+Connection errors, 429 and 5xx responses are retried with exponential
+backoff up to WEBHOOK_MAX_ATTEMPTS times; other 4xx responses are final.
+Pending deliveries do not survive a restart of that process.
+
+Callback URLs come from anonymous clients, so they may only point at
+public addresses: hosts that resolve to loopback, private, link-local or
+reserved addresses are refused when the job is submitted, and again when
+each connection is opened, which catches DNS answers that change in
+between. Hosts in WEBHOOK_ALLOWED_HOSTS (comma-separated) skip the check,
+for receivers on an internal network.
+"""
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 4))
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', 6))
+WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+# First retry after this many seconds, doubling up to WEBHOOK_MAX_BACKOFF
+WEBHOOK_BACKOFF = float(os.environ.get('WEBHOOK_BACKOFF', 1))
+WEBHOOK_MAX_BACKOFF = float(os.environ.get('WEBHOOK_MAX_BACKOFF', 300))
+# Deliveries waiting beyond this are dropped rather than piling up in memory
+WEBHOOK_MAX_PENDING = int(os.environ.get('WEBHOOK_MAX_PENDING', 1000))
+WEBHOOK_ALLOWED_HOSTS = frozenset(
+    host.strip().lower() for host in os.environ.get('WEBHOOK_ALLOWED_HOSTS', '').split(',') if host.strip()
+)
+
+
+class BlockedAddress(Exception):
+    """The callback host is, or resolves to, a non-public address."""
+
+
+def is_public_address(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def check_host(host, port):
+    """Raise BlockedAddress unless every address of host is public."""
+    if host.lower() in WEBHOOK_ALLOWED_HOSTS:
+        return
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as e:
+        raise BlockedAddress(f'cannot resolve {host}: {e}')
+    for address in addresses:
+        if not is_public_address(address):
+            raise BlockedAddress(f'{host} resolves to non-public address {address}')
+
+
+def validate_callback_url(url):
+    """Return an error message for an unusable callback URL, or None."""
+    try:
+        parsed = urlparse(url)
+        host, port = parsed.hostname, parsed.port
+    except ValueError:
+        return 'callback_url must be an absolute http(s) URL'
+    if parsed.scheme not in ('http', 'https') or not host:
+        return 'callback_url must be an absolute http(s) URL'
+    if not WEBHOOK_SECRET:
+        return 'Callbacks are disabled; set WEBHOOK_SECRET to enable them'
+    try:
+        check_host(host, port or (443 if parsed.scheme == 'https' else 80))
+    except BlockedAddress as e:
+        return f'callback_url is not allowed: {e}'
+    return None
+
+
+def _guarded_session(pool_size):
+    """A requests session that refuses to connect to non-public addresses.
+
+    The peer address of every new connection is checked after connecting,
+    so the address actually used is the one checked.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    class GuardedConnection:
+        def _new_conn(self):
+            sock = super()._new_conn()
+            if self.host.lower() not in WEBHOOK_ALLOWED_HOSTS and not is_public_address(sock.getpeername()[0]):
+                address = sock.getpeername()[0]
+                sock.close()
+                raise BlockedAddress(f'{self.host} connected to non-public address {address}')
+            return sock
+
+    class GuardedHTTPConnection(GuardedConnection, HTTPConnection):
+        pass
+
+    class GuardedHTTPSConnection(GuardedConnection, HTTPSConnection):
+        pass
+
+    class GuardedHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = GuardedHTTPConnection
+
+    class GuardedHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = GuardedHTTPSConnection
+
+    class GuardedAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': GuardedHTTPConnectionPool,
+                'https': GuardedHTTPSConnectionPool,
+            }
+
+    session = requests.Session()
+    # A proxy from the environment would be the peer instead of the callback host
+    session.trust_env = False
+    # One connection per sender thread and host is enough
+    adapter = GuardedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def _is_blocked(error):
+    """Whether a send failed on BlockedAddress, possibly wrapped by requests."""
+    while error is not None:
+        if isinstance(error, BlockedAddress):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def sign(body, timestamp, secret=None):
+    """Signature header value for a body sent at timestamp."""
+    secret = WEBHOOK_SECRET if secret is None else secret
+    message = f'{timestamp}.'.encode('utf-8') + body
+    return 'sha256=' + hmac.new(secret.encode('utf-8'), message, hashlib.sha256).hexdigest()
+
+
+def verify(body, timestamp, signature, secret=None, tolerance=300):
+    """Check a received signature; for receivers and tests."""
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(sign(body, timestamp, secret), signature or '')
+
+
+class WebhookDispatcher:
+    """Delivers signed POSTs from a bounded pool of sender threads."""
+
+    def __init__(self, concurrency=WEBHOOK_CONCURRENCY, max_attempts=WEBHOOK_MAX_ATTEMPTS,
+                 timeout=WEBHOOK_TIMEOUT, backoff=WEBHOOK_BACKOFF, max_backoff=WEBHOOK_MAX_BACKOFF,
+                 max_pending=WEBHOOK_MAX_PENDING, secret=None):
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_pending = max_pending
+        self.secret = secret
+        self.session = _guarded_session(concurrency)
+
+        # (due time, sequence, delivery), ordered by due time
+        self._pending = []
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.delivered = 0
+        self.failed = 0
+        self._threads = [
+            threading.Thread(target=self._run, name=f'webhook-sender-{i}', daemon=True)
+            for i in range(concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, url, event, data):
+        """Queue a notification. Returns False when the queue is full."""
+        body = json.dumps({'event': event, 'data': data}, separators=(',', ':')).encode('utf-8')
+        delivery = {'id': uuid.uuid4().hex, 'url': url, 'event': event, 'body': body, 'attempt': 0}
+        with self._cond:
+            if self._closed or len(self._pending) >= self.max_pending:
+                print(f"Dropping {event} webhook to {url}: dispatcher queue is full")
+                self.failed += 1
+                return False
+            self._schedule(delivery, time.monotonic())
+        return True
+
+    def _schedule(self, delivery, due):
+        heapq.heappush(self._pending, (due, next(self._seq), delivery))
+        self._cond.notify()
+
+    def _next_delivery(self):
+        with self._cond:
+            while True:
+                if self._closed and not self._pending:
+                    return None
+                now = time.monotonic()
+                if self._pending and self._pending[0][0] <= now:
+                    self._in_flight += 1
+                    return heapq.heappop(self._pending)[2]
+                timeout = self._pending[0][0] - now if self._pending else None
+                self._cond.wait(timeout)
+
+    def _run(self):
+        while True:
+            delivery = self._next_delivery()
+            if delivery is None:
+                return
+            try:
+                self._attempt(delivery)
+            finally:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+
+    def _attempt(self, delivery):
+        delivery['attempt'] += 1
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'youtube-downloader-webhooks',
+            'X-Webhook-Id': delivery['id'],
+            'X-Webhook-Event': delivery['event'],
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': sign(delivery['body'], timestamp, self.secret),
+        }
+        try:
+            response = self.session.post(delivery['url'], data=delivery['body'], headers=headers,
+                                         timeout=self.timeout, allow_redirects=False)
+            status, error, blocked = response.status_code, None, False
+            response.close()
+        except Exception as e:
+            status, error, blocked = None, str(e), _is_blocked(e)
+
+        if status is not None and 200 <= status < 300:
+            with self._cond:
+                self.delivered += 1
+            return
+        retryable = not blocked and (status is None or status == 429 or status >= 500)
+        reason = error or f'HTTP {status}'
+        if not retryable or delivery['attempt'] >= self.max_attempts:
+            print(f"Giving up on {delivery['event']} webhook to {delivery['url']} "
+                  f"after {delivery['attempt']} attempts: {reason}")
+            with self._cond:
+                self.failed += 1
+            return
+
+        delay = min(self.backoff * 2 ** (delivery['attempt'] - 1), self.max_backoff)
+        delay *= random.uniform(0.5, 1.0)
+        print(f"{delivery['event']} webhook to {delivery['url']} failed ({reason}); retrying in {delay:.1f}s")
+        with self._cond:
+            if not self._closed:
+                self._schedule(delivery, time.monotonic() + delay)
+
+    def drain(self, timeout=None):
+        """Wait until nothing is pending or in flight. Returns True if so."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self, timeout=5):
+        """Deliver what is due within timeout, then stop the sender threads."""
+        self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
@@ -0,0 +1,172 @@
+"""Download workers that pull jobs from the shared job queue.
+
+Run standalone next to the web tier, on the same host or any other host
+that can reach the queue backend:
+
+    JOB_QUEUE_URL=redis://queue-host:6379/0 python worker.py --concurrency 2
+
+The web app also starts EMBEDDED_WORKERS of these as threads in each web
+process, so a single container works without a separate worker.
+"""
+import argparse
+import os
+import socket
+import threading
+import traceback
+import uuid
+
+import jobqueue
+
+
+class JobPaused(Exception):
+    """Raised by a handler to put its job back in the queue as paused.
+
+    Keyword arguments are stored on the job.
+    """
+
+    def __init__(self, message='Job paused', **fields):
+        super().__init__(message)
+        self.fields = fields
+
+
+class JobContext:
+    """Handed to the job handler together with the job.
+
+    update() stores progress fields on the job; lost is set when the lease
+    was taken over by another worker and the handler should stop.
+    """
+
+    def __init__(self, queue, job, worker_id):
+        self.queue = queue
+        self.job = job
+        self.worker_id = worker_id
+        self.lost = threading.Event()
+
+    def update(self, **fields):
+        if not self.queue.update(self.job['id'], self.worker_id, **fields):
+            self.lost.set()
+            return False
+        self.job.update(fields)
+        return True
+
+
+class Worker:
+    """Claims jobs from a queue and runs them through handler(job, context).
+
+    The handler returns a dict of fields stored on the finished job, raises
+    JobPaused to requeue it, or raises anything else to fail it. While it
+    runs, a heartbeat thread keeps the lease alive. Before each claim the
+    worker reaps jobs whose lease ran out elsewhere. An idle worker polls
+    the queue every poll_interval seconds, or sooner when wakeup is set by a
+    local producer. on_complete(job), if given, is called with the final job
+    once it is finished or failed, including jobs this worker's reaping
+    failed for losing too many workers.
+    """
+
+    def __init__(self, queue, handler, worker_id=None, lease_seconds=60, poll_interval=1.0, on_complete=None):
+        self.queue = queue
+        self.handler = handler
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.wakeup = threading.Event()
+        self.on_complete = on_complete
+
+    def _heartbeat(self, context, done):
+        interval = self.lease_seconds / 3
+        while not done.wait(interval):
+            try:
+                if not self.queue.heartbeat(context.job['id'], self.worker_id, self.lease_seconds):
+                    print(f"Worker {self.worker_id} lost the lease on job {context.job['id']}")
+                    context.lost.set()
+                    return
+            except Exception as e:
+                # Keep trying; the lease only lapses if this goes on for lease_seconds
+                print(f"Heartbeat for job {context.job['id']} failed: {e}")
+
+    def _completed(self, job):
+        if self.on_complete:
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                print(f"Completion callback for job {job['id']} failed: {e}")
+
+    def run_once(self):
+        """Claim and run one job. Returns False when the queue was empty."""
+        for failed in self.queue.reap():
+            self._completed(failed)
+        job = self.queue.claim(self.worker_id, self.lease_seconds)
+        if job is None:
+            return False
+
+        context = JobContext(self.queue, job, self.worker_id)
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(context, done), daemon=True)
+        heartbeat.start()
+        try:
+            result = self.handler(job, context) or {}
+            status, fields = jobqueue.FINISHED, result
+        except JobPaused as e:
+            status, fields = jobqueue.PAUSED, e.fields
+        except Exception as e:
+            traceback.print_exc()
+            status, fields = jobqueue.FAILED, {'error': str(e)}
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if context.lost.is_set():
+            pass
+        elif status == jobqueue.PAUSED:
+            self.queue.release(job['id'], self.worker_id, **fields)
+        else:
+            if self.queue.finish(job['id'], self.worker_id, status, **fields):
+                self._completed(self.queue.get(job['id']) or dict(job, status=status, **fields))
+        return True
+
+    def run_forever(self, stop_event=None):
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                print(f"Worker {self.worker_id} error: {e}")
+                traceback.print_exc()
+            if self.wakeup.wait(self.poll_interval):
+                self.wakeup.clear()
+
+
+def start_worker_threads(queue, handler, count, **worker_kwargs):
+    """Run count workers as daemon threads and return (workers, stop_event)."""
+    stop_event = threading.Event()
+    workers = []
+    for _ in range(count):
+        worker = Worker(queue, handler, **worker_kwargs)
+        thread = threading.Thread(target=worker.run_forever, args=(stop_event,), daemon=True)
+        thread.start()
+        workers.append(worker)
+    return workers, stop_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run download workers against the shared job queue')
+    parser.add_argument('--concurrency', type=int, default=int(os.environ.get('WORKER_CONCURRENCY', 2)),
+                        help='jobs this process runs at the same time')
+    parser.add_argument('--lease-seconds', type=float, default=60)
+    args = parser.parse_args()
+
+    import app
+    queue = app.get_job_queue()
+    print(f"Starting {args.concurrency} workers on {app.JOB_QUEUE_URL}")
+    _, stop_event = start_worker_threads(queue, app.run_download_job, args.concurrency,
+                                         lease_seconds=args.lease_seconds, on_complete=app.job_completed)
+    try:
+        while not stop_event.wait(1):
+            pass
+    except KeyboardInterrupt:
+        stop_event.set()
+
+
+if __name__ == '__main__':
+    main()